@@ -6,10 +6,8 @@ import os
 import sys
 import time
 
-# * Import WebClient from Python SDK (github.com/slackapi/python-slack-sdk)
-from slack_sdk import WebClient
-
 # * not standard imports crearted in the project
+from clients import get_web_client
 from config import get_channel_settings
 from utils import get_logger
 
@@ -29,8 +27,8 @@ class ExcelArchiver():
             # * Create a WebClient to be used for Slack API connection
             # * self.client_bot --> This will be a slack bot Connection
             # * self.client_admin --> This will be a slack person Connection
-            self.client_bot = WebClient(token=self.settings.get('slack_token'))
-            self.client_admin = WebClient(token=self.settings.get('slack_token_admin'))
+            self.client_bot = get_web_client(self.settings.get('slack_token'), self.settings)
+            self.client_admin = get_web_client(self.settings.get('slack_token_admin'), self.settings)
 
 
             # * Initialize the Variable needed
@@ -0,0 +1,69 @@
+"""
+Persistent activity index of the channels, shared by ChannelReaper and ExcelArchiver.
+Path : auto-archive/data/activity_index.sqlite (ChannelReaper),
+       auto-archive/data/excelarchive/<WORKSPACE_NAME>activity_index.sqlite (ExcelArchiver, one per workspace and shard)
+       ACTIVITY_INDEX_FILE sets the same file for both.
+Every run records what it learnt about a channel (last activity, members, allowlist, archived)
+so that the next run only queries Slack for the channels whose state could have changed.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+FIELDS = ('name', 'latest_ts', 'activity_ts', 'num_members', 'allowlisted', 'archived', 'checked_at')
+MONOTONIC_FIELDS = ('latest_ts', 'activity_ts')
+
+
+class ActivityIndex():
+    """
+    latest_ts --> ts of the newest message seen in the channel, any subtype
+    activity_ts --> ts of the newest message that counts as activity (not in skip_subtypes)
+    """
+    def __init__(self, path) -> None:
+        self.lock = threading.Lock()
+        # * data/ is not in the repository, a fresh checkout has no directory for the index yet
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS channels ('
+            'channel_id TEXT PRIMARY KEY, name TEXT, latest_ts REAL, activity_ts REAL, '
+            'num_members INTEGER, allowlisted INTEGER, archived INTEGER, checked_at REAL)')
+        self.connection.commit()
+
+    def get(self, channel_id):
+        """ Indexed state of a channel as a dict, None if the channel was never seen. """
+        with self.lock:
+            row = self.connection.execute('SELECT ' + ','.join(FIELDS) + ' FROM channels WHERE channel_id = ?',
+                                          (channel_id,)).fetchone()
+        return dict(zip(FIELDS, row)) if row else None
+
+    def load(self):
+        """ {channel_id: state} for every indexed channel. """
+        with self.lock:
+            rows = self.connection.execute('SELECT channel_id,' + ','.join(FIELDS) + ' FROM channels').fetchall()
+        return {row[0]: dict(zip(FIELDS, row[1:])) for row in rows}
+
+    def update(self, channel_id, **fields):
+        """
+        Insert or update the given fields of a channel, the others keep their indexed value.
+        latest_ts and activity_ts only move forward, an older source (e.g. a sheet export) never lowers them.
+        """
+        fields.setdefault('checked_at', time.time())
+        columns = [column for column in FIELDS if column in fields]
+        sql = ('INSERT INTO channels (channel_id,' + ','.join(columns) + ') VALUES (?' + ',?' * len(columns) + ') '
+               'ON CONFLICT(channel_id) DO UPDATE SET ' + ','.join(
+                   ('%s=MAX(COALESCE(channels.%s, excluded.%s), excluded.%s)' % (column, column, column, column))
+                   if column in MONOTONIC_FIELDS else '%s=excluded.%s' % (column, column) for column in columns))
+        with self.lock:
+            self.connection.execute(sql, [channel_id] + [fields[column] for column in columns])
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
@@ -0,0 +1,80 @@
+"""
+Compiled allowlist matcher.
+Every line of the allowlist is one of:
+    general         --> exact channel name
+    proj-*          --> prefix, everything starting with proj-
+    *-archive-?     --> glob (fnmatch syntax)
+"""
+
+import fnmatch
+import re
+
+GLOB_CHARS = '*?['
+END = None  # * trie key marking the end of a prefix
+
+
+class AllowlistMatcher():
+    """
+    Exact names are kept in a frozenset, prefixes in a trie and globs in one regex.
+    The trie is compiled to a regex too, so a whole Name column is matched in one vectorized pass.
+    """
+    def __init__(self, patterns) -> None:
+        exact = set()
+        globs = []
+        self.trie = {}
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern:
+                continue
+            if not any(char in pattern for char in GLOB_CHARS):
+                exact.add(pattern)
+            elif pattern.endswith('*') and not any(char in pattern[:-1] for char in GLOB_CHARS):
+                self.add_prefix(pattern[:-1])
+            else:
+                globs.append(pattern)
+        self.exact = frozenset(exact)
+
+        alternatives = [fnmatch.translate(pattern) for pattern in globs]
+        if self.trie:
+            alternatives.insert(0, '(?s:' + self.trie_regex(self.trie) + r'.*)\Z')
+        self.regex = re.compile('|'.join(alternatives)) if alternatives else None
+
+    def add_prefix(self, prefix):
+        node = self.trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[END] = True
+
+    @classmethod
+    def trie_regex(cls, node):
+        """ Regex matching any prefix stored below node. A shorter prefix makes longer ones redundant. """
+        if END in node:
+            return ''
+        alternatives = [re.escape(char) + cls.trie_regex(child) for char, child in sorted(node.items())]
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return '(?:' + '|'.join(alternatives) + ')'
+
+    def has_prefix(self, name):
+        node = self.trie
+        for char in name:
+            if END in node:
+                return True
+            node = node.get(char)
+            if node is None:
+                return False
+        return END in node
+
+    def matches(self, name):
+        """ True if a single channel name is allowlisted. """
+        name = str(name)
+        return name in self.exact or self.has_prefix(name) or bool(self.regex and self.regex.match(name))
+
+    def match_series(self, names):
+        """ Boolean Series, True for every allowlisted name of a pandas Series. """
+        # * object dtype keeps the matching on python re (arrow backed strings use RE2 which rejects \Z)
+        names = names.astype(str).astype(object)
+        mask = names.isin(self.exact)
+        if self.regex is not None:
+            mask = mask | names.str.match(self.regex).fillna(False).astype(bool)
+        return mask
@@ -0,0 +1,48 @@
+"""
+Factory of the AsyncWebClient instances used by asyncarchive.py (needs aiohttp).
+    shared aiohttp session --> keep-alive HTTPS connections reused by every coroutine
+    StubTransport of clients.py --> local canned responses, no network, same handlers as the sync clients
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from slack_sdk.web.async_client import AsyncWebClient
+
+from clients import StubTransport, get_transport
+
+# * threads answering the stub requests, the default executor is sized on the CPU count, not on latency
+STUB_EXECUTOR = ThreadPoolExecutor(max_workers=64, thread_name_prefix='stub-slack')
+
+
+class StubAsyncWebClient(AsyncWebClient):
+    """ AsyncWebClient answered by a StubTransport instead of aiohttp. """
+    def __init__(self, transport, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.transport = transport
+
+    async def _request(self, *, http_verb, api_url, req_args):
+        params = {}
+        for key in ('params', 'data', 'json'):
+            params.update(req_args.get(key) or {})
+        # * handlers are plain functions and may block (simulated latency), keep them off the event loop
+        status, headers, payload = await asyncio.get_running_loop().run_in_executor(
+            STUB_EXECUTOR, self.transport.answer, api_url.rsplit('/', 1)[-1], params)
+        return {'data': payload, 'headers': headers, 'status_code': status}
+
+
+def open_session(settings):
+    """ aiohttp session shared by the async clients, to be created and closed inside the event loop. """
+    if isinstance(get_transport(settings), StubTransport):
+        return None
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=settings.get('http_pool_size')),
+                                 timeout=aiohttp.ClientTimeout(total=settings.get('http_timeout')))
+
+
+def get_async_web_client(token, settings, session=None):
+    """ AsyncWebClient for token, offline when the shared transport is a StubTransport. """
+    transport = get_transport(settings)
+    if isinstance(transport, StubTransport):
+        return StubAsyncWebClient(transport, token=token)
+    return AsyncWebClient(token=token, session=session, timeout=settings.get('http_timeout'))
@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+
+# * not standard imports crearted in the project
+from async_clients import get_async_web_client, open_session
+from excelarchive import ExcelArchiver
+from members import ChannelMembers
+from metrics import timed
+from ratelimit import AsyncRateLimiter
+from report import ReportWriter
+from results import ChannelResult
+
+# * stages of the per channel pipeline, in the order their results are merged in df_filtered_data
+PIPELINE = ["get_channel_members", "invite_to_channel", "refetch_channel_members", "archive_channel"]
+
+
+class AsyncExcelArchiver(ExcelArchiver):
+    """
+    ExcelArchiver running the members, invite and archive stages as one pipeline per channel on
+    asyncio with AsyncWebClient: a channel is archived as soon as its own members are saved,
+    async_channels_inflight channels are in the pipeline at a time, tier_max_inflight bounds the
+    requests in flight per Slack Tier. Reading, the report, the rollback store and the journal
+    are the ones of ExcelArchiver, so a run can be resumed by either archiver.
+    """
+    def __init__(self, resume=False, overrides=None) -> None:
+        super().__init__(resume=resume, overrides=overrides)
+        try:
+            self.async_ratelimiter = AsyncRateLimiter(tier_limits=self.settings.get('rate_limit_tiers'),
+                                                      max_retries=self.settings.get('max_retries'),
+                                                      logger=self.logger, metrics=self.metrics,
+                                                      tier_inflight=self.settings.get('tier_max_inflight'))
+            self.aclient_bot = self.aclient_admin = None
+        except Exception as e:
+            self.exit_on_critical_exception(e)
+
+    ## * Process all the data, on an event loop
+    def processdata(self):
+        try:
+            self.logger.info("Name,ID,Members")
+            asyncio.run(self.process_pipeline())
+            self.update_activity_index()
+        except Exception as e:
+            self.logger.error(e)
+
+    async def process_pipeline(self):
+        session = open_session(self.settings)
+        self.aclient_bot = get_async_web_client(self.settings.get('slack_token'), self.settings, session)
+        self.aclient_admin = get_async_web_client(self.settings.get('slack_token_admin'), self.settings, session)
+        if self.report is None:
+            self.report = ReportWriter(self.settings.get('archive_filename'), self.df_filtered_data.columns)
+        results = {stage: [] for stage in PIPELINE}
+        # * channels finish out of order, their report rows wait here until the previous rows are written
+        self.report_pending = {}
+        self.report_next = 0
+        channels = asyncio.Queue()
+        for item in enumerate(zip(self.df_filtered_data.index, self.df_filtered_data.to_dict('records'))):
+            channels.put_nowait(item)
+        try:
+            workers = [self.pipeline_worker(channels, results) for _ in range(self.settings.get('async_channels_inflight'))]
+            await asyncio.gather(*workers)
+        finally:
+            self.journal.flush()
+            if session is not None:
+                await session.close()
+        # * same results, same order of application as the stage by stage ExcelArchiver
+        for stage in PIPELINE:
+            self.merge_results(results[stage])
+
+    async def pipeline_worker(self, channels, results):
+        while not channels.empty():
+            position, (index, row) = channels.get_nowait()
+            for stage, result in await self.process_channel(position, index, row):
+                results[stage].append(result)
+
+    ## * Every stage of one channel, each stage reads the row as updated by the previous ones
+    async def process_channel(self, position, index, row):
+        done = []
+
+        async def run(stage, coroutine):
+            result = await self.run_journaled_async(stage, coroutine, index, row)
+            done.append((stage, result))
+            return result.apply_to(row)
+
+        row = await run("get_channel_members", self.get_channel_members_async)
+        if not (self.settings.get('dry_run') or row["Allowlisted"] or row["IsBotMember"]):
+            row = await run("invite_to_channel", self.invite_to_channel_async)
+            if row["GetMembersFailed"] and row["IsBotMember"]:
+                row = await run("refetch_channel_members", self.refetch_channel_members_async)
+        result = await self.run_journaled_async("archive_channel", self.archive_channel_async, index, row)
+        done.append(("archive_channel", result))
+        self.write_report_row_in_order(position, row, result)
+        return done
+
+    ## * Write the report rows in the order of df_filtered_data, like the stage by stage ExcelArchiver
+    def write_report_row_in_order(self, position, row, result):
+        self.report_pending[position] = (row, result)
+        while self.report_next in self.report_pending:
+            self.write_report_row(*self.report_pending.pop(self.report_next))
+            self.report_next += 1
+
+    ## * Replay the journaled result of the channel if the stage already finished it, else run the stage
+    async def run_journaled_async(self, stage, coroutine, index, row):
+        result = self.journal.lookup(stage, row["ID"], index)
+        if result is None:
+            result = await coroutine(row, index)
+            self.journal.record(stage, row["ID"], result)
+        return result
+
+    @timed('get_channel_members')
+    async def get_channel_members_async(self, row, index):
+        result = ChannelResult(index)
+        try:
+            if not row["Allowlisted"]:
+                members = ChannelMembers()
+                cursor = None
+                while True:
+                    response = await self.async_ratelimiter.call(self.aclient_bot.conversations_members, channel=row["ID"],
+                                                                 limit=self.settings.get('members_page_size'), cursor=cursor)  # ** Tier 4 100+ per minute
+                    members.add_page(response["members"])
+                    self.payloads.write('members', id=row["ID"], name=row["Name"], members=response["members"])
+                    cursor = (response.get("response_metadata") or {}).get("next_cursor")
+                    if not cursor:
+                        break
+                self.save_channel_members(row, result, members)
+        except Exception as e:
+            self.members_error(row, result, e)
+        return result
+
+    @timed('invite_to_channel')
+    async def invite_to_channel_async(self, row, index):
+        result = ChannelResult(index)
+        try:
+            await self.async_ratelimiter.call(self.aclient_admin.admin_conversations_invite, channel_id=row["ID"],
+                                              user_ids=[self.bot_user_id])  # ** Tier 2 20+ per minute
+            result.is_bot_member = True
+        except Exception as e:
+            self.invite_error(result, e)
+        return result
+
+    async def refetch_channel_members_async(self, row, index):
+        result = await self.get_channel_members_async(row, index)
+        if not result.errors:
+            result.get_members_failed = False
+            result.is_error = False
+            result.error_message = ""
+        return result
+
+    @timed('archive_channel')
+    async def archive_channel_async(self, row, index):
+        result = ChannelResult(index)
+        try:
+            if not (row["Allowlisted"] == True or (row["IsError"] == True)):
+                if not self.settings.get('dry_run'):
+                    await self.async_ratelimiter.call(self.aclient_bot.conversations_archive, channel=row["ID"])  # ** Tier 2 20+ per minute
+            else:
+                result.archive_failed = True
+        except Exception as e:
+            self.archive_error(result, e)
+        return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive the channels listed in channels.xlsx, asyncio pipeline')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the channels already processed by a previous run (see journal.jsonl)')
+    parser.add_argument('--shard', default=None,
+                        help='i/N, only process the channels of shard i out of N (see shards.py)')
+    args = parser.parse_args()
+    ASYNC_EXCEL_ARCHIVER = AsyncExcelArchiver(resume=args.resume, overrides={'shard': args.shard} if args.shard else None)
+    ASYNC_EXCEL_ARCHIVER.main()
@@ -10,12 +10,15 @@ import sys
 import time
 import json
 import logging
-# Import WebClient from Python SDK (github.com/slackapi/python-slack-sdk)
-from slack_sdk import WebClient
+# Import SlackApiError from Python SDK (github.com/slackapi/python-slack-sdk)
 from slack_sdk.errors import SlackApiError
 
 # not standard imports
+from activity_index import ActivityIndex
+from clients import get_web_client
+from allowlist import AllowlistMatcher
 from config import get_channel_reaper_settings
+from ratelimit import RateLimiter
 from utils import get_logger
 
 
@@ -28,9 +31,16 @@ class ChannelReaper():
         self.settings = get_channel_reaper_settings()
         #self.logger = get_logger('channel_reaper', './'+datetime.now().strftime("%d_%m_%Y %H_%M_%S")+'audit.log')
         self.logger = get_logger('channel_reaper', './'+datetime.now().strftime("%d_%m_%Y")+'audit.log')
-        self.client = WebClient(token=self.settings.get('slack_token'))
+        self.client = get_web_client(self.settings.get('slack_token'), self.settings)
         self.logger = logging.getLogger(__name__)
         self.logger.info(self.settings)
+        self.ratelimiter = RateLimiter(tier_limits=self.settings.get('rate_limit_tiers'),
+                                       max_retries=self.settings.get('max_retries'),
+                                       logger=self.logger)
+        # cache of get_all_channels for the run
+        self.all_channels = None
+        # state of the channels learnt by previous runs (last activity, members, whitelist)
+        self.activity_index = ActivityIndex(self.settings.get('activity_index_file'))
 
     def get_whitelist_keywords(self):
         """
@@ -63,24 +73,63 @@ This will bring it back at any point. In the future, you can add '%%noarchive' t
         return alerts
 
     def get_all_channels(self):
-        """ Get a list of all non-archived channels from slack channels.list. """
-
+        """
+        Get a list of all non-archived channels from slack conversations.list.
+        All the pages are fetched once with large limits and cached for the run.
+        """
+        if self.all_channels is not None:
+            return self.all_channels
         try:
-            result = self.client.conversations_list(exclude_archived = 1)
-
-            channels = result["channels"]
             all_channels = []
-            for channel in channels:
-                all_channels.append({
-                    'id': channel['id'],
-                    'name': channel['name'],
-                    'created': channel['created'],
-                    'num_members': channel['num_members']
-                })
+            cursor = None
+            while True:
+                result = self.ratelimiter.call(self.client.conversations_list, exclude_archived=1,
+                                               limit=self.settings.get('channels_page_size'), cursor=cursor)
+                for channel in result["channels"]:
+                    all_channels.append({
+                        'id': channel['id'],
+                        'name': channel['name'],
+                        'created': channel['created'],
+                        'num_members': channel.get('num_members', 0),
+                        'updated': channel.get('updated', 0)
+                    })
+                cursor = (result.get("response_metadata") or {}).get("next_cursor")
+                if not cursor:
+                    break
+            self.all_channels = all_channels
             return all_channels
         except SlackApiError as e:
             self.logger.error("Error fetching conversations: {}".format(e))
+            return []
 
+    def get_candidate_channels(self, channels, whitelist_matcher, too_old_datetime):
+        """
+        Pre-filter channels on their conversations.list metadata so that only the ambiguous
+        ones need a conversations.history request in is_channel_disused.
+        """
+        min_members = self.settings.get('min_members')
+        too_old_ts = time.mktime(too_old_datetime.timetuple())
+        indexed = self.activity_index.load()
+        candidates = []
+        for channel in channels:
+            whitelisted = self.is_channel_whitelisted(channel, whitelist_matcher)
+            self.activity_index.update(channel['id'], name=channel['name'], num_members=channel['num_members'],
+                                       allowlisted=int(whitelisted))
+            # whitelisted channels are never archived
+            if whitelisted:
+                continue
+            # active at the last run and the activity is still newer than the cut off, no need to look again
+            state = indexed.get(channel['id'])
+            if state and state['activity_ts'] and state['activity_ts'] > too_old_ts:
+                continue
+            # a channel created after the cut off can not have been inactive long enough
+            if datetime.fromtimestamp(float(channel['created'])) > too_old_datetime:
+                continue
+            # channels with at least min_members are kept whatever their activity
+            if min_members and channel['num_members'] >= min_members:
+                continue
+            candidates.append(channel)
+        return candidates
 
     def get_last_message_timestamp(self, channel_history, too_old_datetime):
         """ Get the last message from a slack channel, and return the time. """
@@ -106,6 +155,43 @@ This will bring it back at any point. In the future, you can add '%%noarchive' t
             return (last_bot_message_datetime, False)
         return (last_message_datetime, True)
 
+    def probe_last_activity(self, channel_id, oldest):
+        """
+        Return the ts of the newest message after oldest that is not in skip_subtypes, None if there is none.
+        History is read in small pages, more is only asked for when the newest messages are all skipped.
+        Results are kept in the activity index by channel ID and latest ts, a channel with no message
+        newer than the indexed latest ts costs a single limit=probe_page_size request.
+        """
+        cached = self.activity_index.get(channel_id)
+        since = oldest
+        if cached and cached['latest_ts'] and cached['latest_ts'] > oldest:
+            since = cached['latest_ts']
+
+        latest_ts = activity_ts = cursor = None
+        limit = self.settings.get('probe_page_size')
+        while True:
+            history = self.ratelimiter.call(self.client.conversations_history, channel=channel_id,
+                                            limit=limit, oldest=since, cursor=cursor)
+            messages = history.get('messages') or []
+            if messages and latest_ts is None:
+                latest_ts = float(messages[0]['ts'])
+            for message in messages:
+                if message.get('subtype') not in self.settings.get('skip_subtypes'):
+                    activity_ts = float(message['ts'])
+                    break
+            cursor = (history.get('response_metadata') or {}).get('next_cursor')
+            if activity_ts is not None or not history.get('has_more') or not cursor:
+                break
+            limit = min(limit * 2, 100)
+
+        # nothing new since the last probe, the cached activity still holds
+        if since != oldest:
+            latest_ts = latest_ts or cached['latest_ts']
+            if activity_ts is None:
+                activity_ts = cached['activity_ts']
+        self.activity_index.update(channel_id, latest_ts=latest_ts, activity_ts=activity_ts)
+        return activity_ts if activity_ts and activity_ts > oldest else None
+
     def is_channel_disused(self, channel, too_old_datetime):
         """ Return True or False depending on if a channel is "active" or not.  """
         try:
@@ -113,9 +199,9 @@ This will bring it back at any point. In the future, you can add '%%noarchive' t
 
             channel_id = channel['id']
             messages_after_date = time.mktime(self.settings.get('too_old_datetime').timetuple())
-            self.logger.info(channel_id);
-            channel_history = self.client.conversations_history(channel=channel_id , count = 100 , oldest = messages_after_date)
-            self.logger.info(channel_history)
+            activity_ts = self.probe_last_activity(channel_id, messages_after_date)
+            self.logger.debug('%s last activity %s' % (channel_id, activity_ts))
+            channel_history = {'messages': [{'ts': activity_ts}] if activity_ts else []}
             (last_message_datetime, is_user) = self.get_last_message_timestamp(
                 channel_history, datetime.fromtimestamp(float(channel['created'])))
             # mark inactive if last message is too old, but don't
@@ -145,12 +231,8 @@ This will bring it back at any point. In the future, you can add '%%noarchive' t
                     'skip_channel_str') in channel_topic:
             return True
         '''
-        # check the white listed channels (file / env)
-        for white_listed_channel in white_listed_channels:
-            wl_channel_name = white_listed_channel.strip('#')
-            if wl_channel_name in channel['name']:
-                return True
-        return False
+        # check the white listed channels (file / env), compiled once in main
+        return white_listed_channels.matches(channel['name'])
 
     def send_channel_message(self, channel_id, message):
         """ Send a message to a channel or user. """
@@ -175,7 +257,8 @@ This will bring it back at any point. In the future, you can add '%%noarchive' t
             channel_message = alert.format(self.settings.get('days_inactive'))
             self.send_channel_message(channel['id'], channel_message)
             #payload = {'channel': channel['id']}
-            self.client.conversations_archive(channel = channel['id'])
+            self.ratelimiter.call(self.client.conversations_archive, channel = channel['id'])
+            self.activity_index.update(channel['id'], archived=1)
             #self.slack_api_http(api_endpoint=api_endpoint, payload=payload)
             self.logger.info(stdout_message)
 
@@ -201,26 +284,28 @@ This will bring it back at any point. In the future, you can add '%%noarchive' t
 
         whitelist_keywords = self.get_whitelist_keywords()
         self.logger.info(whitelist_keywords)
+        # a whitelisted keyword matches every channel name containing it
+        whitelist_matcher = AllowlistMatcher('*' + keyword.strip('#') + '*' for keyword in whitelist_keywords if keyword.strip('#'))
         alert_templates = self.get_channel_alerts()
         self.logger.info(alert_templates)
         archived_channels = []
 
-        self.logger.info(self.get_all_channels())
-        for channel in self.get_all_channels():
+        all_channels = self.get_all_channels()
+        candidates = self.get_candidate_channels(all_channels, whitelist_matcher,
+                                                 self.settings.get('too_old_datetime'))
+        self.logger.info('%d channels, %d need an activity check' % (len(all_channels), len(candidates)))
+        for channel in candidates:
             sys.stdout.write('.')
             sys.stdout.flush()
 
-            channel_whitelisted = self.is_channel_whitelisted(
-                channel, whitelist_keywords)
-            self.logger.info(channel_whitelisted)
-
             channel_disused = self.is_channel_disused(
                 channel, self.settings.get('too_old_datetime'))
             self.logger.info(channel_disused)
-            if (not channel_whitelisted and channel_disused):
+            if channel_disused:
                 archived_channels.append(channel)
                 self.archive_channel(channel,alert_templates['channel_template'])
 
+        self.activity_index.close()
         self.send_admin_report(archived_channels)
 
 if __name__ == '__main__':
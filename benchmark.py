@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""
+Offline throughput benchmark of ExcelArchiver.
+A simulated Slack (FakeSlack) answers through clients.StubTransport with Tier rate limits,
+429 + Retry-After, cursor pagination and latency. For every sheet size a channels sheet is
+generated and readdata --> processdata --> writedata is run against it, each size in its own
+process so the peak RSS of a size is not inherited from the previous ones.
+Usage : python benchmark.py --channels 10000 50000 200000 --concurrency 8
+429 run : python benchmark.py --channels 2000 --window-s 1 --overdrive 4 --expect-429
+    the archiver budgets are 4 times what FakeSlack allows per 1s window, every 429 must be retried
+"""
+
+from collections import deque, Counter
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import logging
+import math
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+import clients
+from excelarchive import ExcelArchiver
+from ratelimit import METHOD_TIERS, TIER_LIMITS
+
+
+class FakeSlack():
+    """
+    Simulated Slack Web API. Each Tier allows tier_limits[tier] * speedup calls per minute, counted
+    over a sliding window of window seconds: over the budget calls get a 429 with Retry-After like
+    the real API. A short window makes the 429s (and their Retry-After) happen within a benchmark.
+    """
+    def __init__(self, members_per_channel=50, users=100000, latency=0.005, speedup=1000,
+                 page_size_cap=1000, bot_user_id='UBOT00000', window=60.0) -> None:
+        self.members_per_channel = members_per_channel
+        self.users = users
+        self.latency = latency
+        self.page_size_cap = page_size_cap
+        self.bot_user_id = bot_user_id
+        self.window = window
+        self.limits = {tier: max(1, int(per_minute * speedup * window / 60)) for tier, per_minute in TIER_LIMITS.items()}
+        self.windows = {tier: deque() for tier in TIER_LIMITS}
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def handlers(self):
+        methods = {
+            'auth.test': lambda params: {'ok': True, 'user_id': self.bot_user_id},
+            'conversations.members': self.conversations_members,
+        }
+        for method in ('conversations.archive', 'admin.conversations.invite', 'files.upload',
+                       'chat.postMessage', 'conversations.unarchive', 'admin.conversations.unarchive'):
+            methods.setdefault(method, lambda params: {'ok': True})
+        return {method: self.wrap(method, handler) for method, handler in methods.items()}
+
+    def wrap(self, method, handler):
+        tier = METHOD_TIERS.get(method.replace('.', '_'), 2)
+
+        def call(params):
+            time.sleep(self.latency)
+            throttled = self.throttle(tier)
+            with self.lock:
+                self.counts[method if throttled is None else method + ' (429)'] += 1
+            return throttled or handler(params)
+        return call
+
+    def throttle(self, tier):
+        """ Sliding window per Tier, returns a 429 answer when the budget is spent. """
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows[tier]
+            while window and window[0] <= now - self.window:
+                window.popleft()
+            if len(window) < self.limits[tier]:
+                window.append(now)
+                return None
+            retry_after = max(1, math.ceil(window[0] + self.window - now))
+        return (429, {'Retry-After': str(retry_after)}, {'ok': False, 'error': 'ratelimited'})
+
+    def conversations_members(self, params):
+        channel = params['channel']
+        limit = min(int(params.get('limit') or 100), self.page_size_cap)
+        start = int(params.get('cursor') or 0)
+        seed = int(channel[1:])
+        members = ['U%08d' % ((seed * 7919 + i) % self.users) for i in range(self.members_per_channel)]
+        if seed % 3 == 0:
+            members.append(self.bot_user_id)
+        end = min(start + limit, len(members))
+        return {'ok': True, 'members': members[start:end],
+                'response_metadata': {'next_cursor': str(end) if end < len(members) else ''}}
+
+
+def generate_sheet(path, channels):
+    """ channels sheet with the columns of the Slack workspace export. """
+    df = pd.DataFrame({
+        'Name': ['channel-%d' % i for i in range(channels)],
+        'ID': ['C%08d' % i for i in range(channels)],
+        'Members': [50] * channels,
+        'Archived': [0] * channels,
+        'Last activity': ['Mon, 01 Jan 2018 00:00:00 +0000'] * channels,
+    })
+    extension = os.path.splitext(path)[1]
+    if extension == '.csv':
+        df.to_csv(path, index=False)
+    elif extension == '.parquet':
+        df.to_parquet(path)
+    else:
+        df.to_excel(path, index=False)
+
+
+def peak_rss_mb():
+    """ Peak RSS of the process, so of the sheet size it runs. """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def rss_mb():
+    """ Current RSS, the peak where /proc is not available. """
+    try:
+        with open('/proc/self/statm') as filecontent:
+            return int(filecontent.read().split()[1]) * resource.getpagesize() / 1024.0 / 1024.0
+    except (OSError, IndexError, ValueError):
+        return peak_rss_mb()
+
+
+def run(channels, args, workdir):
+    """ Run the archiver on a generated sheet and return the measurements of every stage. """
+    overdrive = getattr(args, 'overdrive', 1.0)
+    sheet = 'channels_%d.%s' % (channels, args.format)
+    if not os.path.isfile(os.path.join(workdir, sheet)):
+        generate_sheet(os.path.join(workdir, sheet), channels)
+    os.environ.update({
+        'EXCELARCHIVE_DATA_PATH': workdir + '/',
+        'CHANNELS_FILE': sheet,
+        'WORKSPACE_NAME': 'bench%d_' % channels,
+        'SLACK_OFFLINE': 'true',
+        'CONCURRENCY': str(args.concurrency),
+        'BOT_MAX_INFLIGHT': str(args.concurrency),
+        'ADMIN_MAX_INFLIGHT': str(args.concurrency),
+        'DRY_RUN': 'true' if args.dry_run else 'false',
+        'TIER2_PER_MINUTE': str(int(TIER_LIMITS[2] * args.speedup * overdrive)),
+        'TIER3_PER_MINUTE': str(int(TIER_LIMITS[3] * args.speedup * overdrive)),
+        'TIER4_PER_MINUTE': str(int(TIER_LIMITS[4] * args.speedup * overdrive)),
+    })
+    slack = FakeSlack(members_per_channel=args.members, latency=args.latency_ms / 1000.0, speedup=args.speedup,
+                      window=getattr(args, 'window_s', 60.0))
+    clients.set_transport(clients.StubTransport(slack.handlers(), record=False))
+
+    stages = {}
+    trace = getattr(args, 'tracemalloc', False)
+    if trace:
+        tracemalloc.start()
+
+    def timed(name, func):
+        """ Wall time and RSS growth of the stage, with --tracemalloc also its own allocation peak. """
+        def wrapper(*a, **kw):
+            rss = rss_mb()
+            if trace:
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            try:
+                return func(*a, **kw)
+            finally:
+                stages[name] = {'wall_s': round(time.perf_counter() - start, 3), 'rss_mb': round(rss_mb(), 1),
+                                'rss_delta_mb': round(rss_mb() - rss, 1)}
+                if trace:
+                    stages[name]['alloc_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0, 1)
+        return wrapper
+
+    total = time.perf_counter()
+    if args.async_mode:
+        from asyncarchive import AsyncExcelArchiver
+        archiver = timed('startup', AsyncExcelArchiver)()
+    else:
+        archiver = timed('startup', ExcelArchiver)()
+    if not args.verbose:
+        archiver.logger.setLevel(logging.WARNING)
+    run_stage = archiver.run_stage
+    archiver.run_stage = lambda stage, *a, **kw: timed(stage.__name__, run_stage)(stage, *a, **kw)
+    timed('readdata', archiver.readdata)()
+    timed('processdata', archiver.processdata)()
+    timed('writedata', archiver.writedata)()
+    archiver.journal.close()
+    wall = time.perf_counter() - total
+    if trace:
+        tracemalloc.stop()
+    metrics = archiver.metrics.summary()
+    return {
+        'channels': channels,
+        'wall_s': round(wall, 3),
+        'channels_per_minute': round(channels / wall * 60, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'stages': stages,
+        'api_calls': dict(slack.counts),
+        'rate_limited': sum(count for method, count in slack.counts.items() if method.endswith('(429)')),
+        'retries': sum(measure.get('retries', 0) for measure in metrics.get('api', {}).values()),
+        'errors': archiver.totals['errors'],
+        'metrics': metrics,
+    }
+
+
+def run_isolated(channels, args, workdir):
+    """ run in a fresh process, ru_maxrss is then the peak of this sheet size only. """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run, channels, args, workdir).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline throughput benchmark of ExcelArchiver')
+    parser.add_argument('--channels', type=int, nargs='+', default=[10000])
+    parser.add_argument('--members', type=int, default=50, help='members per channel')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='simulated latency of every API call')
+    parser.add_argument('--speedup', type=int, default=1000, help='multiplier of the Tier budgets')
+    parser.add_argument('--window-s', type=float, default=60.0, help='rate limit window of FakeSlack in seconds')
+    parser.add_argument('--overdrive', type=float, default=1.0,
+                        help='archiver Tier budgets as a multiple of the FakeSlack ones, above 1 triggers 429s')
+    parser.add_argument('--expect-429', action='store_true',
+                        help='fail unless FakeSlack answered 429s and the archiver retried every one of them')
+    parser.add_argument('--tracemalloc', action='store_true', help='also measure the allocation peak of every stage (slower)')
+    parser.add_argument('--format', choices=('xlsx', 'csv', 'parquet'), default='xlsx')
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--async', dest='async_mode', action='store_true', help='run AsyncExcelArchiver (needs aiohttp)')
+    parser.add_argument('--workdir', default=None, help='keeps the generated sheets between runs')
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='slack-archive-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    with open(os.path.join(workdir, 'allowlist.txt'), 'w') as filecontent:
+        filecontent.write('general\nrandom\n')
+
+    results = []
+    failed = False
+    for channels in args.channels:
+        result = run_isolated(channels, args, workdir)
+        results.append(result)
+        print('%8d channels  %9.1f channels/min  wall %8.2fs  peak RSS %7.1f MB  429 %d  retries %d  errors %d' % (
+            channels, result['channels_per_minute'], result['wall_s'], result['peak_rss_mb'],
+            result['rate_limited'], result['retries'], result['errors']))
+        for stage, measure in result['stages'].items():
+            print('    %-24s %8.2fs  RSS %7.1f MB (%+.1f)%s' % (
+                stage, measure['wall_s'], measure['rss_mb'], measure['rss_delta_mb'],
+                '  alloc peak %.1f MB' % measure['alloc_peak_mb'] if 'alloc_peak_mb' in measure else ''))
+        if args.expect_429 and not (result['rate_limited'] and result['retries'] >= result['rate_limited']):
+            print('    429 responses %d, retried %d' % (result['rate_limited'], result['retries']))
+            failed = True
+    if args.json:
+        with open(args.json, 'w') as filecontent:
+            json.dump(results, filecontent, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+Factory of the WebClient instances used by the archivers.
+All the clients share one transport:
+    PooledTransport --> keep-alive HTTPS connections reused by every worker thread
+    StubTransport --> local canned responses, no network, used to run the whole pipeline offline
+The bot user ID of a token (auth.test) is cached on disk for bot_user_ttl seconds.
+"""
+
+import hashlib
+import http.client
+import io
+import json
+import os
+import queue
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, urlsplit
+
+# * Import WebClient from Python SDK (github.com/slackapi/python-slack-sdk)
+from slack_sdk import WebClient
+
+
+class PooledTransport():
+    """
+    At most pool_size connections per host, idle connections are kept open and reused,
+    so the TLS handshake happens once per connection instead of once per request.
+    """
+    def __init__(self, pool_size=8, timeout=30, ssl_context=None) -> None:
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.idle = {}
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def _slots(self, host):
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.pool_size)
+                self.idle[host] = queue.LifoQueue()
+            return self.slots[host], self.idle[host]
+
+    def _connect(self, scheme, host):
+        if scheme == 'http':
+            return http.client.HTTPConnection(host, timeout=self.timeout)
+        return http.client.HTTPSConnection(host, timeout=self.timeout, context=self.ssl_context)
+
+    def request(self, url, req):
+        """ Send a urllib Request, same return value and errors as urlopen in WebClient. """
+        parts = urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        headers = dict(req.header_items())
+        slots, idle = self._slots(parts.netloc)
+        with slots:
+            try:
+                connection = idle.get_nowait()
+            except queue.Empty:
+                connection = self._connect(parts.scheme, parts.netloc)
+            try:
+                try:
+                    connection.request(req.get_method(), path, body=req.data, headers=headers)
+                    response = connection.getresponse()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    # * the server closed an idle keep-alive connection, retry once on a fresh one
+                    connection.close()
+                    connection = self._connect(parts.scheme, parts.netloc)
+                    connection.request(req.get_method(), path, body=req.data, headers=headers)
+                    response = connection.getresponse()
+                body = response.read()
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                idle.put(connection)
+        return build_response(url, response.status, response.reason, response.headers, body)
+
+
+class StubTransport():
+    """
+    Offline transport. handlers maps a Slack method name (e.g. "conversations.members") to a
+    callable taking the request params and returning either a response dict or a
+    (status, headers, response dict) tuple. Methods without a handler answer {"ok": true}.
+    With record=True every (method, params) is kept in calls.
+    """
+    DEFAULTS = {
+        'auth.test': lambda params: {'ok': True, 'user_id': 'UBOT00000'},
+        'conversations.members': lambda params: {'ok': True, 'members': [], 'response_metadata': {'next_cursor': ''}},
+    }
+
+    def __init__(self, handlers=None, record=True) -> None:
+        self.handlers = dict(self.DEFAULTS)
+        self.handlers.update(handlers or {})
+        self.record = record
+        self.calls = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def params(req):
+        data = req.data or b''
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        if data.startswith('{'):
+            return json.loads(data)
+        return dict(parse_qsl(data))
+
+    def answer(self, method, params):
+        """ (status, headers, response dict) of the handler of method. """
+        if self.record:
+            with self.lock:
+                self.calls.append((method, params))
+        handler = self.handlers.get(method)
+        answer = handler(params) if handler else {'ok': True}
+        status, headers, payload = answer if isinstance(answer, tuple) else (200, {}, answer)
+        return status, dict(headers, **{'Content-Type': 'application/json; charset=utf-8'}), payload
+
+    def request(self, url, req):
+        status, headers, payload = self.answer(urlsplit(url).path.rsplit('/', 1)[-1], self.params(req))
+        return build_response(url, status, 'Stub', headers, json.dumps(payload).encode('utf-8'))
+
+
+def http_headers(headers):
+    """ Headers as urlopen gives them (WebClient reads the charset and Retry-After of an HTTPError from them). """
+    if isinstance(headers, http.client.HTTPMessage):
+        return headers
+    message = http.client.HTTPMessage()
+    for name, value in headers.items():
+        message[name] = str(value)
+    return message
+
+
+def build_response(url, status, reason, headers, body):
+    """ urlopen raises on error statuses, WebClient relies on it to handle 429 and 5xx. """
+    if status >= 400:
+        raise HTTPError(url, status, reason, http_headers(headers), io.BytesIO(body))
+    content_type = headers.get('Content-Type', '') or ''
+    if content_type.startswith('application/gzip'):
+        return {'status': status, 'headers': headers, 'body': body}
+    charset = 'utf-8'
+    if 'charset=' in content_type:
+        charset = content_type.split('charset=', 1)[1].split(';', 1)[0].strip()
+    return {'status': status, 'headers': headers, 'body': body.decode(charset)}
+
+
+class PooledWebClient(WebClient):
+    """
+    WebClient sending its requests through a shared transport instead of one urlopen per call.
+    With metrics set, the bytes sent and received are counted per Slack method.
+    """
+    def __init__(self, transport, metrics=None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.transport = transport
+        self.metrics = metrics
+
+    def _perform_urllib_http_request_internal(self, url, req):
+        if self.proxy is not None:
+            response = super()._perform_urllib_http_request_internal(url, req)
+        else:
+            response = self.transport.request(url, req)
+        if self.metrics:
+            body = response['body']
+            self.metrics.api_bytes(urlsplit(url).path.rsplit('/', 1)[-1].replace('.', '_'), len(req.data or b''),
+                                   len(body.encode('utf-8') if isinstance(body, str) else body))
+        return response
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def set_transport(transport):
+    """ Replace the shared transport, e.g. with a StubTransport to run offline. """
+    global _transport
+    with _transport_lock:
+        _transport = transport
+
+
+def get_transport(settings):
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            if settings.get('offline'):
+                _transport = StubTransport()
+            else:
+                _transport = PooledTransport(pool_size=settings.get('http_pool_size'),
+                                             timeout=settings.get('http_timeout'))
+        return _transport
+
+
+def get_web_client(token, settings, metrics=None):
+    """ WebClient for token, sharing the pooled connections of every other client of the process. """
+    return PooledWebClient(get_transport(settings), metrics=metrics, token=token, timeout=settings.get('http_timeout'))
+
+
+def get_bot_user_id(client, settings):
+    """
+    user_id of auth.test for the token of client, read from bot_user_cache_file while younger than
+    bot_user_ttl seconds. The cache is keyed by a sha256 of the token, the token itself is not stored.
+    """
+    path = settings.get('bot_user_cache_file')
+    token = getattr(client, 'token', None)
+    if not (path and token and settings.get('bot_user_ttl', 0) > 0) or settings.get('offline'):
+        return client.auth_test()["user_id"]
+    key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    try:
+        with open(path) as filecontent:
+            cache = json.load(filecontent)
+    except (OSError, ValueError):
+        cache = {}
+    entry = cache.get(key) or {}
+    if entry.get('user_id') and 0 <= time.time() - entry.get('checked_at', 0) < settings.get('bot_user_ttl'):
+        return entry['user_id']
+    user_id = client.auth_test()["user_id"]
+    cache[key] = {'user_id': user_id, 'checked_at': time.time()}
+    try:
+        # * write then rename, workspaces running in parallel may share the file
+        temporary = '%s.%d.tmp' % (path, os.getpid())
+        with open(temporary, 'w') as filecontent:
+            json.dump(cache, filecontent)
+        os.replace(temporary, path)
+    except OSError:
+        pass
+    return user_id
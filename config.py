@@ -2,14 +2,29 @@
 All settings you can change for running slack channel reaper will live in this file.
 """
 
+import copy
 import os
 from datetime import datetime, timedelta
 
+# * environment --> settings resolved for it, see get_channel_settings
+_channel_settings = {}
+
 
 def get_channel_settings():
-    """ This returns a dictionary of all settings. """
+    """
+    This returns a dictionary of all settings, resolved once per environment: every caller of the
+    run gets its own copy of the same values (same too_old_datetime, same dated log file).
+    """
+    key = tuple(sorted(os.environ.items()))
+    if key not in _channel_settings:
+        _channel_settings[key] = resolve_channel_settings()
+    return copy.deepcopy(_channel_settings[key])
+
+
+def resolve_channel_settings():
+    """ Read the settings from the environment. """
     days_inactive = int(os.environ.get('DAYS_INACTIVE', 365))
-    excelarchive_data_path = os.path.dirname(os.path.abspath(__file__)) + "/data/excelarchive/"
+    excelarchive_data_path = os.environ.get('EXCELARCHIVE_DATA_PATH', os.path.dirname(os.path.abspath(__file__)) + "/data/excelarchive/")
     return {
         'admin_channel': os.environ.get('ADMIN_CHANNEL', '<Slack Admin Channel>'),
         'days_inactive': days_inactive,
@@ -18,9 +33,78 @@ def get_channel_settings():
         'slack_token': os.environ.get('SLACK_TOKEN', '<Slack Bot Token>'),
         'too_old_datetime': (datetime.now() - timedelta(days=days_inactive)),
         'root_dir' : os.path.dirname(os.path.abspath(__file__)) ,
+        'audit_log_file' : os.environ.get('WORKSPACE_NAME', '') + datetime.now().strftime("%d_%m_%Y") + 'audit.log',
         'allowlistfile' : excelarchive_data_path + "allowlist.txt",
-        'channelscsvfile' : excelarchive_data_path + "channels.xlsx" ,
-        'archive_filename' : excelarchive_data_path + os.environ.get('WORKSPACE_NAME', '')+"archived_output.xlsx",
+        'channelscsvfile' : excelarchive_data_path + os.environ.get('CHANNELS_FILE', "channels.xlsx") ,
+        'inactivity_filter' : (os.environ.get('INACTIVITY_FILTER', 'false') == 'true'),
+        'shard' : os.environ.get('SHARD', ''),
+        'discovery' : (os.environ.get('DISCOVERY', 'false') == 'true'),
+        'discovery_channel_types' : os.environ.get('DISCOVERY_CHANNEL_TYPES', 'exclude_archived'),
+        'discovery_page_size' : int(os.environ.get('DISCOVERY_PAGE_SIZE', 20)),
+        'discovery_batch_size' : int(os.environ.get('DISCOVERY_BATCH_SIZE', 100)),
+        'archive_filename' : excelarchive_data_path + os.environ.get('WORKSPACE_NAME', '')+"archived_output." + os.environ.get('REPORT_FORMAT', 'xlsx'),
         'unarchive_filename' : excelarchive_data_path + "unarchive.xlsx",
-        'unarchive_output' : excelarchive_data_path + "unarchive_output.xlsx"
+        'unarchive_output' : excelarchive_data_path + "unarchive_output.xlsx",
+        'invite_batch_size' : int(os.environ.get('INVITE_BATCH_SIZE', 1000)),
+        'restore_concurrency' : int(os.environ.get('RESTORE_CONCURRENCY', 4)),
+        'rate_limit_tiers' : {
+            2: int(os.environ.get('TIER2_PER_MINUTE', 20)),
+            3: int(os.environ.get('TIER3_PER_MINUTE', 50)),
+            4: int(os.environ.get('TIER4_PER_MINUTE', 100)),
+        },
+        'max_retries' : int(os.environ.get('MAX_RETRIES', 5)),
+        'concurrency' : int(os.environ.get('CONCURRENCY', 1)),
+        'bot_max_inflight' : int(os.environ.get('BOT_MAX_INFLIGHT', 4)),
+        'admin_max_inflight' : int(os.environ.get('ADMIN_MAX_INFLIGHT', 2)),
+        'members_page_size' : int(os.environ.get('MEMBERS_PAGE_SIZE', 1000)),
+        'tier_max_inflight' : {
+            2: int(os.environ.get('TIER2_MAX_INFLIGHT', 4)),
+            3: int(os.environ.get('TIER3_MAX_INFLIGHT', 8)),
+            4: int(os.environ.get('TIER4_MAX_INFLIGHT', 16)),
+        },
+        'async_channels_inflight' : int(os.environ.get('ASYNC_CHANNELS_INFLIGHT', 64)),
+        'rollback_dir' : excelarchive_data_path + os.environ.get('WORKSPACE_NAME', '')+"members_rollback",
+        'journal_file' : excelarchive_data_path + os.environ.get('WORKSPACE_NAME', '')+"journal.jsonl",
+        'journal_flush_every' : int(os.environ.get('JOURNAL_FLUSH_EVERY', 50)),
+        # * one index per workspace, ACTIVITY_INDEX_FILE points ExcelArchiver at the index of ChannelReaper instead
+        'activity_index_file' : os.environ.get('ACTIVITY_INDEX_FILE', excelarchive_data_path + os.environ.get('WORKSPACE_NAME', '')+"activity_index.sqlite"),
+        'use_activity_index' : (os.environ.get('USE_ACTIVITY_INDEX', 'false') == 'true'),
+        'offline' : (os.environ.get('SLACK_OFFLINE', 'false') == 'true'),
+        'http_pool_size' : int(os.environ.get('HTTP_POOL_SIZE', 8)),
+        'http_timeout' : int(os.environ.get('HTTP_TIMEOUT', 30)),
+        'metrics_file' : excelarchive_data_path + os.environ.get('WORKSPACE_NAME', '')+"metrics.json",
+        'metrics_prometheus_file' : os.environ.get('METRICS_PROMETHEUS_FILE', ''),
+        'restore_metrics_file' : excelarchive_data_path + os.environ.get('WORKSPACE_NAME', '')+"restore_metrics.json",
+        'log_queue' : (os.environ.get('LOG_QUEUE', 'false') == 'true'),
+        # * opt-in (PAYLOAD_LOG=true) member pages in gzip JSON lines, the rollback store already holds the members
+        'payload_log_file' : (excelarchive_data_path + os.environ.get('WORKSPACE_NAME', '')+"payloads.jsonl.gz") if os.environ.get('PAYLOAD_LOG', 'false') == 'true' else '',
+        'bot_user_cache_file' : excelarchive_data_path + os.environ.get('WORKSPACE_NAME', '')+"bot_user_cache.json",
+        'bot_user_ttl' : int(os.environ.get('BOT_USER_TTL', 86400))
+    }
+
+
+def get_channel_reaper_settings():
+    """ This returns a dictionary of all settings used by the channel reaper. """
+    days_inactive = int(os.environ.get('DAYS_INACTIVE', 60))
+    return {
+        'admin_channel': os.environ.get('ADMIN_CHANNEL', ''),
+        'days_inactive': days_inactive,
+        'dry_run': (os.environ.get('DRY_RUN', 'false') == 'true'),
+        'min_members': int(os.environ.get('MIN_MEMBERS', 0)),
+        'skip_subtypes': {'channel_leave', 'channel_join'},
+        'slack_token': os.environ.get('SLACK_TOKEN', '<Slack Bot Token>'),
+        'too_old_datetime': (datetime.now() - timedelta(days=days_inactive)),
+        'root_dir' : os.path.dirname(os.path.abspath(__file__)),
+        'channels_page_size' : int(os.environ.get('CHANNELS_PAGE_SIZE', 1000)),
+        'probe_page_size' : int(os.environ.get('PROBE_PAGE_SIZE', 2)),
+        'activity_index_file' : os.environ.get('ACTIVITY_INDEX_FILE', os.path.dirname(os.path.abspath(__file__)) + "/data/activity_index.sqlite"),
+        'rate_limit_tiers' : {
+            2: int(os.environ.get('TIER2_PER_MINUTE', 20)),
+            3: int(os.environ.get('TIER3_PER_MINUTE', 50)),
+            4: int(os.environ.get('TIER4_PER_MINUTE', 100)),
+        },
+        'max_retries' : int(os.environ.get('MAX_RETRIES', 5)),
+        'offline' : (os.environ.get('SLACK_OFFLINE', 'false') == 'true'),
+        'http_pool_size' : int(os.environ.get('HTTP_POOL_SIZE', 8)),
+        'http_timeout' : int(os.environ.get('HTTP_TIMEOUT', 30))
     }
@@ -1,17 +1,30 @@
-from datetime import datetime
-import pandas as pd
-from dateutil.relativedelta import relativedelta
-import numpy as np 
+from datetime import datetime, timezone
+import argparse
+from collections import Counter
 import os
 import sys
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# * Import WebClient from Python SDK (github.com/slackapi/python-slack-sdk)
-from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
 
 # * not standard imports crearted in the project
+from activity_index import ActivityIndex
+from clients import get_bot_user_id, get_web_client
+from allowlist import AllowlistMatcher
 from config import get_channel_settings
-from utils import get_logger
+from journal import StageJournal
+from members import ChannelMembers, MemberStore
+from metrics import Metrics, timed
+from ratelimit import RateLimiter
+from report import ReportWriter, report_format, write_frame
+from results import ChannelResult, apply_results
+from shards import parse_shard, shard_of, shard_settings
+from utils import PayloadLog, get_logger
+
+# * columns of df_filtered_data read by the processing stages
+STAGE_COLUMNS = ["ID", "Name", "Allowlisted", "IsError"]
+INVITE_COLUMNS = STAGE_COLUMNS + ["IsBotMember", "GetMembersFailed"]
 
 
 class ExcelArchiver():
@@ -20,29 +33,68 @@ class ExcelArchiver():
     Path : auto-archive/data/excelarchive/
     Filename : channels.csv
     """
-    def __init__(self) -> None:
+    def __init__(self, resume=False, overrides=None) -> None:
         try:
-            # * get settings 
+            # * get settings, overrides (e.g. from a workspaces manifest) take precedence over the environment
             self.settings = get_channel_settings()
-            self.logger = get_logger('excel_archiver', datetime.now().strftime("%d_%m_%Y")+'audit.log')
+            self.settings.update(overrides or {})
+            # * with a shard (i/N) only the channels of that shard are processed, into per shard outputs (see shards.py)
+            self.shard = parse_shard(self.settings.get('shard')) if self.settings.get('shard') else None
+            if self.shard:
+                shard_settings(self.settings, *self.shard)
+            # * with log_queue the log file and console are written by a listener thread, not the workers
+            self.logger = get_logger('excel_archiver', self.settings.get('audit_log_file'),
+                                     queued=self.settings.get('log_queue'))
+            # * fail at startup rather than after the run on a report format that cannot be written (REPORT_FORMAT)
+            report_format(self.settings.get('archive_filename'))
+
+            # * Time spent per stage and per Slack method, written at the end of the run (see metrics.py)
+            self.metrics = Metrics()
             
-            # * Create a WebClient to be used for Slack API connection
+            # * Create a WebClient to be used for Slack API connection, both share the pooled connections (see clients.py)
             # * self.client_bot --> This will be a slack bot Connection
             # * self.client_admin --> This will be a slack person Connection
-            self.client_bot = WebClient(token=self.settings.get('slack_token'))
-            self.client_admin = WebClient(token=self.settings.get('slack_token_admin'))
+            self.client_bot = get_web_client(self.settings.get('slack_token'), self.settings, metrics=self.metrics)
+            self.client_admin = get_web_client(self.settings.get('slack_token_admin'), self.settings, metrics=self.metrics)
+
+            # * Shared scheduler for all the Slack API calls, one token bucket per Slack Tier
+            self.ratelimiter = RateLimiter(tier_limits=self.settings.get('rate_limit_tiers'),
+                                           max_retries=self.settings.get('max_retries'),
+                                           logger=self.logger, metrics=self.metrics)
 
+            # * Bound the number of requests in flight per client when running concurrently
+            self.inflight_bot = threading.BoundedSemaphore(self.settings.get('bot_max_inflight'))
+            self.inflight_admin = threading.BoundedSemaphore(self.settings.get('admin_max_inflight'))
 
             # * Initialize the Variable needed
             # * df_csv --> dataframe for reading the source excel.(channels.csv)
             # * df_filtered_data --> dataframe after filtering source df_csv
             # * allowlistkeywords --> store all the allowlist
-            self.df_csv = pd.DataFrame()
-            self.df_filtered_data = pd.DataFrame()
+            self.df_csv = None
+            self.df_filtered_data = None
             self.allowlistkeywords = self.get_allow_list()
 
+            # * Members of every channel go to the compact rollback store, kept across runs, the report is streamed while archiving
+            self.rollback = MemberStore(self.settings.get('rollback_dir'))
+            self.report = None
+            self.totals = Counter()
+
+            # * Member lists are kept out of the audit log, with PAYLOAD_LOG=true also in a gzip JSON lines stream (settings: payload_log_file)
+            self.payloads = PayloadLog(self.settings.get('payload_log_file'), resume=resume)
+
+            # * Optional index of the channel states learnt by previous runs (settings: use_activity_index)
+            self.activity_index = ActivityIndex(self.settings.get('activity_index_file')) if self.settings.get('use_activity_index') else None
+
+            # * Journal of the finished stages, with resume=True channels already done are skipped
+            self.journal = StageJournal(self.settings.get('journal_file'), resume=resume,
+                                        flush_every=self.settings.get('journal_flush_every'),
+                                        before_flush=self.flush_rollback, dry_run=self.settings.get('dry_run'),
+                                        retried_later=('get_channel_members',))
+            if self.journal.dropped:
+                self.logger.info('%d journal entries of a dry run ignored, their channels are processed again' % self.journal.dropped)
+
             # * Get bot userid to add to all Private Channels to be archived
-            self.bot_user_id = self.client_bot.auth_test()["user_id"] # ** Volume is not a issue as this is only claled once
+            self.bot_user_id = get_bot_user_id(self.client_bot, self.settings) # ** auth.test at most once per bot_user_ttl
 
         except Exception as e:
             self.exit_on_critical_exception(e)
@@ -54,11 +106,14 @@ class ExcelArchiver():
         sys.exit(1)
 
     ## * Read all the source data needed
+    @timed('readdata')
     def readdata(self):
         try:
-            # * read the csv sourcefile in dataframe
+            # * pandas is only loaded here, the archiver starts without it
+            from sheets import inactive_mask, read_channels
+            # * read the sourcefile in dataframe (xlsx, csv, parquet or feather, see sheets.py)
             csvfile = self.settings.get('channelscsvfile')
-            self.df_csv = pd.read_excel(csvfile)
+            self.df_csv = read_channels(csvfile, self.logger)
             # * convert the last activity Column to datetime
             """
             Commented for Future Automations ... PLEASE DO NOT DELETE.
@@ -70,23 +125,116 @@ class ExcelArchiver():
             ###filtered_values = np.where(((self.df_csv['Last activity']< datetime.now()- relativedelta(days=self.settings.get('days_inactive')))) & (self.df_csv['Archived']!= 1.0 ))
             ###self.df_filtered_data = (self.df_csv.loc[filtered_values])
             """
-            self.df_filtered_data = (self.df_csv)
-            # * add new columns to capture the log and errors when processing the channels.
-            self.df_filtered_data["MembersList"] = ""           # * captures all the members in the channel 
-            self.df_filtered_data["Allowlisted"] = False        # * will be True if channel is allowlisted
-            self.df_filtered_data["IsBotMember"] = False        # * will be True if bot is already in the channel
-            self.df_filtered_data["IsError"] = False            # * will be True if error occurs while processing the channel
-            self.df_filtered_data["ErrorMessage"] = ""          # * captures the error message
-            self.df_filtered_data["IsCriticalError"] = False    # * will be True if Critical occurs while processing the channel
-            self.df_filtered_data["CriticalErrorMessage"] = ""  # * captures the Critical error message
-            self.df_filtered_data["InviteFailed"] = False       # * will be True if Invite Event executes without error is allowlisted
-            self.df_filtered_data["GetMembersFailed"] = False   # * will be True Members are fetched without error
-            self.df_filtered_data["ArchiveFailed"] = False      # * will be True if archived without error
+            # * inactivity filter on the parsed Last activity (see sheets.py), one mask over the whole sheet
+            if self.settings.get('inactivity_filter'):
+                mask = inactive_mask(self.df_csv, self.settings.get('too_old_datetime'))
+                self.logger.info('%d of %d channels inactive for %d days' % (mask.sum(), len(mask), self.settings.get('days_inactive')))
+                self.df_csv = self.df_csv.loc[mask].copy()
+            self.df_filtered_data = self.prepare_channels(self.df_csv)
         except Exception as e:
             self.exit_on_critical_exception(e)
 
+    ## * Add the columns the stages fill to a frame of channels (sheet or discovered batch)
+    def prepare_channels(self, df):
+        if self.shard:
+            index, count = self.shard
+            df = df.loc[shard_of(df["ID"].to_numpy(), count) == index].copy()
+        # * with the activity index, channels already archived or still active at the last run are not queried again
+        if self.activity_index is not None:
+            df = self.skip_indexed_channels(df)
+        # * add new columns to capture the log and errors when processing the channels.
+        df["MembersCount"] = 0           # * number of members saved in the rollback file
+        df["Allowlisted"] = self.allowlistkeywords.match_series(df["Name"])  # * True if channel is allowlisted
+        df["IsBotMember"] = False        # * will be True if bot is already in the channel
+        df["IsError"] = False            # * will be True if error occurs while processing the channel
+        df["ErrorMessage"] = ""          # * captures the error message
+        df["IsCriticalError"] = False    # * will be True if Critical occurs while processing the channel
+        df["CriticalErrorMessage"] = ""  # * captures the Critical error message
+        df["InviteFailed"] = False       # * will be True if Invite Event executes without error is allowlisted
+        df["GetMembersFailed"] = False   # * will be True Members are fetched without error
+        df["ArchiveFailed"] = False      # * will be True if archived without error
+        return df
+
+
+    ## * Discovery mode (settings: discovery): no sheet, the channels inactive since too_old_datetime are found with
+    ## * admin.conversations.search and processed batch by batch, only one batch is held in memory
+    def discover_channels(self):
+        batch = []
+        for channel in self.iter_discovered_channels():
+            batch.append(channel)
+            if len(batch) >= self.settings.get('discovery_batch_size'):
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    ## * Page through every channel of admin.conversations.search, archived channels excluded by the server
+    ## * The search has no documented sort on activity, the channels active after too_old_datetime are skipped here
+    def iter_discovered_channels(self):
+        too_old = self.settings.get('too_old_datetime').timestamp()
+        cursor = None
+        while True:
+            response = self.call_api(self.client_admin.admin_conversations_search,
+                                     search_channel_types=self.settings.get('discovery_channel_types'),
+                                     limit=self.settings.get('discovery_page_size'), cursor=cursor)  # ** Tier 2 20+ per minute
+            for conversation in response.get("conversations") or []:
+                last_activity = conversation.get("last_activity_ts") or conversation.get("created") or 0
+                # * last_activity_ts is in milliseconds
+                if last_activity > 1e11:
+                    last_activity = last_activity / 1000.0
+                if last_activity > too_old:
+                    continue
+                yield {"Name": conversation.get("name"), "ID": conversation.get("id"),
+                       "Members": conversation.get("member_count"),
+                       "Archived": int(bool(conversation.get("is_archived"))),
+                       "Last activity": datetime.fromtimestamp(last_activity, timezone.utc).strftime('%a, %d %b %Y %H:%M:%S %z'),
+                       "LastActivityTs": float(last_activity)}
+            cursor = response.get("next_cursor") or (response.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                return
+
+    ## * Run the stages on every discovered batch, the report is shared by the batches
+    def process_discovered(self):
+        import pandas as pd
+        offset = 0
+        for batch in self.discover_channels():
+            self.df_filtered_data = self.prepare_channels(pd.DataFrame(batch, index=range(offset, offset + len(batch))))
+            offset += len(batch)
+            self.logger.info('%d channels discovered' % offset)
+            self.processdata()
+
+    ## * Drop the channels the activity index knows are archived or active after too_old_datetime
+    def skip_indexed_channels(self, df):
+        indexed = self.activity_index.load()
+        ids = df["ID"].astype(str)
+        activity = ids.map({channel_id: state['activity_ts'] for channel_id, state in indexed.items() if state['activity_ts']})
+        archived = ids.map({channel_id: bool(state['archived']) for channel_id, state in indexed.items() if state['archived']})
+        skip = ((activity.fillna(0).to_numpy(dtype=float) > self.settings.get('too_old_datetime').timestamp())
+                | archived.fillna(False).to_numpy(dtype=bool))
+        self.logger.info('%d channels skipped, archived or active in the activity index' % skip.sum())
+        return df.loc[~skip].copy()
+
+    ## * Record what this run learnt about the channels in the activity index
+    def update_activity_index(self):
+        if self.activity_index is None:
+            return
+        frame = self.df_filtered_data
+        # * Last activity of the sheet (or the search), lets the next run skip the channels still active
+        activity = frame["LastActivityTs"] if "LastActivityTs" in frame.columns else [None] * len(frame)
+        for channel_id, name, members, allowlisted, members_failed, archive_failed, activity_ts in zip(
+                frame["ID"], frame["Name"], frame["MembersCount"], frame["Allowlisted"],
+                frame["GetMembersFailed"], frame["ArchiveFailed"], activity):
+            fields = {'name': name, 'allowlisted': int(allowlisted)}
+            if activity_ts is not None and activity_ts == activity_ts:
+                fields['activity_ts'] = float(activity_ts)
+            if not (allowlisted or members_failed):
+                fields['num_members'] = int(members)
+            if not (archive_failed or self.settings.get('dry_run')):
+                fields['archived'] = 1
+            self.activity_index.update(channel_id, **fields)
+        self.activity_index.commit()
     
-    ## * Read the allowlistfile and return the list of keywords
+    ## * Read the allowlistfile and return the compiled matcher of names, prefixes and globs
     def get_allow_list(self):
         try:        
             keywords = []
@@ -96,8 +244,7 @@ class ExcelArchiver():
             else:
                 raise Exception("File Not Found : " + self.settings.get('allowlistfile'))
             
-            keywords = map(lambda x: x.strip(), keywords)
-            return list(keywords)
+            return AllowlistMatcher(keywords)
         except Exception as e:
             self.exit_on_critical_exception(e)
 
@@ -106,80 +253,196 @@ class ExcelArchiver():
         try:
             self.logger.info("Name,ID,Members")
             ## * Get Channel Members and append it to dataframe 
-            for index, row in self.df_filtered_data.iterrows():           
-                self.get_channel_members(row,index)
+            self.merge_results(self.run_stage(self.get_channel_members))
+
+            ## * Add the bot to the channels it is not a member of yet, then fetch the members again
+            ## * of the channels the bot could not read before the invite (private channels)
+            if not self.settings.get('dry_run'):
+                frame = self.df_filtered_data
+                self.merge_results(self.run_stage(self.invite_to_channel, columns=INVITE_COLUMNS,
+                                                  mask=~(frame["Allowlisted"] | frame["IsBotMember"])))
+                frame = self.df_filtered_data
+                self.merge_results(self.run_stage(self.refetch_channel_members, columns=INVITE_COLUMNS,
+                                                  mask=frame["GetMembersFailed"] & frame["IsBotMember"]))
 
-            ## * Archive channels and apend the output to dataframe
-            for index, row in self.df_filtered_data.iterrows():
-                self.archive_channel(row,index)
+            ## * Archive channels, apend the output to dataframe and stream every finished channel to the report
+            if self.report is None:
+                self.report = ReportWriter(self.settings.get('archive_filename'), self.df_filtered_data.columns)
+            self.merge_results(self.run_stage(self.archive_channel, columns=self.df_filtered_data.columns,
+                                              on_result=self.write_report_row))
+            self.update_activity_index()
         except Exception as e:
             self.logger.error(e)
-    
+
+    ## * Run one stage for every row (or the rows selected by mask), sequentially or on a bounded thread pool (settings: concurrency)
+    ## * Rows are plain dicts of the columns the stage reads, results come back in row order
+    def run_stage(self, stage, columns=STAGE_COLUMNS, on_result=None, mask=None):
+        frame = self.df_filtered_data if mask is None else self.df_filtered_data.loc[mask]
+        rows = list(zip(frame.index, frame[columns].to_dict('records')))
+        run = lambda item: self.run_journaled(stage, item)
+        executor = ThreadPoolExecutor(max_workers=self.settings.get('concurrency')) if self.settings.get('concurrency') > 1 else None
+        results = []
+        try:
+            for (index, row), result in zip(rows, executor.map(run, rows) if executor else map(run, rows)):
+                if on_result:
+                    on_result(row, result)
+                results.append(result)
+            return results
+        finally:
+            if executor:
+                executor.shutdown()
+            self.journal.flush()
+
+    ## * Replay the journaled result of the channel if the stage already finished it, else run the stage
+    def run_journaled(self, stage, item):
+        index, row = item
+        result = self.journal.lookup(stage.__name__, row["ID"], index)
+        if result is None:
+            result = stage(row, index)
+            self.journal.record(stage.__name__, row["ID"], result)
+        return result
+
+    ## * Push the rollback store and the payload stream to disk before the journal marks channels as done
+    def flush_rollback(self):
+        self.rollback.flush()
+        self.payloads.flush()
+
+    ## * Apply the results of one stage to df_filtered_data in one vectorized join
+    def merge_results(self, results):
+        apply_results(self.df_filtered_data, results)
+
+    ## * Call a Slack method within the in-flight limit of its client and the Tier budget
+    def call_api(self, func, **kwargs):
+        inflight = self.inflight_admin if func.__self__ is self.client_admin else self.inflight_bot
+        with inflight:
+            return self.ratelimiter.call(func, **kwargs)
+
+    ## * Append the final row of a channel to the report and count it in the run totals
+    def write_report_row(self, row, result):
+        row = result.apply_to(row)
+        self.report.write_row(result.index, row)
+        self.totals["channels"] += 1
+        self.totals["allowlisted"] += int(bool(row["Allowlisted"]))
+        self.totals["errors"] += int(bool(row["IsError"]))
+        self.totals["archived"] += int(not row["ArchiveFailed"])
+
     ## * Wite the final data froma to excel and send it to slack admin channel
+    @timed('writedata')
     def writedata(self):
         try:
-            self.df_filtered_data.to_excel(self.settings.get('archive_filename'))
+            self.rollback.close()
+            self.payloads.close()
+            if self.report is None:
+                # * processing did not start, write whatever was read
+                write_frame(self.df_filtered_data, self.settings.get('archive_filename'))
+            else:
+                self.report.close()
             self.send_file_to_channel(self.settings.get('admin_channel'),self.settings.get('archive_filename'))
         except Exception as e:
             self.logger.error(e)
 
     ## * Invite the bot to Private Channel so that bot has access to archive the channel
+    ## * Only run for the channels the members stage did not find the bot in
+    @timed('invite_to_channel')
     def invite_to_channel(self,row,index):
+        result = ChannelResult(index)
         try:
-            time.sleep(3)
-            result = self.client_admin.admin_conversations_invite(channel_id= row["ID"], user_ids = [self.bot_user_id]) # ** Tier 2 20+ per minute
+            self.call_api(self.client_admin.admin_conversations_invite, channel_id= row["ID"], user_ids = [self.bot_user_id]) # ** Tier 2 20+ per minute
+            result.is_bot_member = True
         except Exception as e:
-            self.df_filtered_data.at[index, 'ErrorMessage'] = format(e) + row['ErrorMessage']
-            self.df_filtered_data.at[index, 'IsError'] = True
-            self.df_filtered_data.at[index, 'InviteFailed'] = True
+            self.invite_error(result, e)
+        return result
+
+    def invite_error(self, result, e):
+        # * the bot joined since the members were fetched (or they could not be fetched), nothing to do
+        if isinstance(e, SlackApiError) and e.response.get("error") == "already_in_channel":
+            result.is_bot_member = True
+        else:
+            result.add_error(e, 'invite_failed')
             self.logger.error(e)
 
-    ## * Get memebers of each channel and add to Memberlist column for rollbacks
+    ## * Fetch again the members of a channel the bot could not read before being invited
+    def refetch_channel_members(self,row,index):
+        result = self.get_channel_members(row,index)
+        if not result.errors:
+            result.get_members_failed = False
+            result.is_error = False
+            # * the error of the first attempt is stale now the members are saved
+            result.error_message = ""
+        return result
+
+    ## * Get memebers of each channel and save them in the rollback store
+    @timed('get_channel_members')
     def get_channel_members(self,row,index):
+        result = ChannelResult(index)
         try:
             channel_id = row["ID"]
-            # * check if channel is allowlisted if yes archiving is not needed comment as whitelisted in the MemberList
-            if row["Name"] not in self.allowlistkeywords:
-                # * Add bot to Private Channels in scope
-                if ((not self.settings.get('dry_run'))):
-                    self.invite_to_channel(row,index)
-
-                # * Get members for each channel and add it to dataframe to send as attachment to Slack Admin Channel
-                membersArray= self.client_bot.conversations_members(channel=channel_id , limit = 8000)["members"]  # ** Tier 4 100+ per minute
-                membersStr = ','.join(membersArray)
-                self.df_filtered_data.at[index, 'MembersList'] = membersStr
-
-                # * if bot is already a member it will raise an exception on invite to channel which can be ignored
-                # * ignore the error by setting IsBotMember = True and IsError = False
-                if self.bot_user_id in membersStr:
-                    self.df_filtered_data.at[index, "IsBotMember"] = True
-                    self.df_filtered_data.at[index, "IsError"] = False
-                    
-                # * Capyuring this as fall back in case someting goes bad
-                self.logger.info('%s,%s,"%s"' % (row["Name"],row["ID"],membersStr))
-            else:
-                self.df_filtered_data.at[index, 'Allowlisted'] = True
+            # * allowlisted channels (flagged in readdata) are not archived, no need to fetch members
+            if not row["Allowlisted"]:
+                # * Get members for each channel page by page and save them to the rollback store
+                members = ChannelMembers()
+                for page in self.iter_channel_members(channel_id):
+                    members.add_page(page)
+                    # * Capyuring this as fall back in case someting goes bad
+                    self.payloads.write('members', id=row["ID"], name=row["Name"], members=page)
+                self.save_channel_members(row, result, members)
         except Exception as e:
-            self.df_filtered_data.at[index, 'ErrorMessage'] = format(e) + row['ErrorMessage']
-            self.df_filtered_data.at[index, 'IsError'] = True
-            self.df_filtered_data.at[index, 'GetMembersFailed'] = True
+            self.members_error(row, result, e)
+        return result
+
+    def members_error(self, row, result, e):
+        result.add_error(e, 'get_members_failed')
+        # * a private channel the bot is not in yet, expected: members are fetched again after the invite
+        if isinstance(e, SlackApiError) and e.response.get("error") in ("channel_not_found", "not_in_channel") and not row.get("IsBotMember"):
+            self.logger.info('%s,%s,members not readable before the bot is invited' % (row["Name"], row["ID"]))
+        else:
             self.logger.error(e)
 
+    ## * Save the fetched members of a channel to the rollback store and the result
+    def save_channel_members(self, row, result, members):
+        self.rollback.add_channel(row["ID"], row["Name"], members)
+        self.logger.info('%s,%s,%d' % (row["Name"],row["ID"],len(members)))
+        result.members_count = len(members)
+
+        # * if bot is already a member there is no need to invite it (see invite_to_channel)
+        if self.bot_user_id in members:
+            result.is_bot_member = True
+            result.is_error = False
+
+    ## * Yield the members of a channel one page at a time following response_metadata.next_cursor
+    def iter_channel_members(self, channel_id):
+        cursor = None
+        while True:
+            response = self.call_api(self.client_bot.conversations_members, channel=channel_id,
+                                     limit=self.settings.get('members_page_size'), cursor=cursor)  # ** Tier 4 100+ per minute
+            yield response["members"]
+            cursor = (response.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                break
+
+    @timed('archive_channel')
     def archive_channel(self,row,index):
+        result = ChannelResult(index)
         try:
             if not (row["Allowlisted"] == True or (row["IsError"] == True)):
                 if not self.settings.get('dry_run'):
-                    time.sleep(3)
-                    self.client_bot.conversations_archive(channel = row["ID"]) # ** Tier 2 20+ per minute
+                    self.call_api(self.client_bot.conversations_archive, channel = row["ID"]) # ** Tier 2 20+ per minute
             else:
-                self.df_filtered_data.at[index, 'ArchiveFailed'] = True
+                result.archive_failed = True
                     
         except Exception as e:
-            self.df_filtered_data.at[index, 'ErrorMessage'] = format(e) + row['ErrorMessage']
-            self.df_filtered_data.at[index, 'IsError'] = True
-            self.df_filtered_data.at[index, 'ArchiveFailed'] = True
+            self.archive_error(result, e)
+        return result
+
+    def archive_error(self, result, e):
+        # * archived by a run killed before its journal was flushed, the channel is archived as asked
+        if isinstance(e, SlackApiError) and e.response.get("error") == "already_archived":
+            result.archive_failed = False
+        else:
+            result.add_error(e, 'archive_failed')
             self.logger.error(e)
 
+    @timed('send_file_to_channel')
     def send_file_to_channel(self, channel_id, file_name):
         """ Send a message to a channel or user. """
         try:
@@ -188,7 +451,7 @@ class ExcelArchiver():
             else:
                 comment = "Please find the list of channels Archived in the attachment."
             # Call the chat.postMessage method using the WebClient # ** Tier not a problem as this will be 1 time call
-            result = self.client_bot.files_upload(
+            result = self.call_api(self.client_bot.files_upload,
                 channel=channel_id,
                 initial_comment= comment,
                 file=file_name,
@@ -218,13 +481,37 @@ class ExcelArchiver():
                 self.logger.info(
                     'THIS IS A DRY RUN. NO CHANNELS ARE ACTUALLY ARCHIVED.')
                 
-            self.readdata()
-            self.processdata()
+            if self.settings.get('discovery'):
+                self.process_discovered()
+            else:
+                self.readdata()
+                self.processdata()
             self.writedata()
 
         except Exception as e:
             self.logger.error(e)
+        finally:
+            self.journal.close()
+            self.payloads.close()
+            if self.activity_index is not None:
+                self.activity_index.close()
+            self.write_metrics()
+
+    ## * Write the stage and API call measurements of the run (settings: metrics_file, metrics_prometheus_file)
+    def write_metrics(self):
+        try:
+            self.metrics.write_json(self.settings.get('metrics_file'))
+            if self.settings.get('metrics_prometheus_file'):
+                self.metrics.write_prometheus(self.settings.get('metrics_prometheus_file'))
+        except Exception as e:
+            self.logger.error(e)
 
 if __name__ == '__main__':
-    EXCEL_ARCHIVER = ExcelArchiver()
+    parser = argparse.ArgumentParser(description='Archive the channels listed in channels.xlsx')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the channels already processed by a previous run (see journal.jsonl)')
+    parser.add_argument('--shard', default=None,
+                        help='i/N, only process the channels of shard i out of N (see shards.py)')
+    args = parser.parse_args()
+    EXCEL_ARCHIVER = ExcelArchiver(resume=args.resume, overrides={'shard': args.shard} if args.shard else None)
     EXCEL_ARCHIVER.main()
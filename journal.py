@@ -0,0 +1,93 @@
+"""
+Append only JSON-lines journal of the stage results of an archival run.
+Every line is one channel finished by one stage, a run started with --resume
+replays the journal and skips those channels instead of calling Slack again.
+Entries written by a dry run are marked, a real run never replays them (nothing was archived).
+Only completed stages are journaled: a failed or skipped stage is run again by a resumed run.
+"""
+
+import json
+import os
+import threading
+
+from results import ChannelResult
+
+
+class StageJournal():
+    """
+    Path : auto-archive/data/excelarchive/
+    Filename : <WORKSPACE_NAME>journal.jsonl
+    """
+    def __init__(self, path, resume=False, flush_every=50, before_flush=None, dry_run=False, retried_later=()) -> None:
+        self.path = path
+        # * stages whose failures a later stage of the same run retries (e.g. members fetched again after the invite)
+        self.retried_later = set(retried_later)
+        self.dry_run = bool(dry_run)
+        self.before_flush = before_flush
+        self.flush_every = flush_every
+        self.completed = {}
+        self.buffer = []
+        self.partial = False
+        self.dropped = 0
+        self.lock = threading.Lock()
+        if resume and os.path.isfile(path):
+            self.load()
+        # * a fresh run starts a new journal, a resumed run appends to it
+        self.file = open(path, 'a' if resume else 'w')
+        if self.partial:
+            self.file.write('\n')
+
+    def load(self):
+        with open(self.path) as filecontent:
+            for line in filecontent:
+                self.partial = not line.endswith('\n')
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # * last line can be partial if the previous run was killed while writing
+                    continue
+                if entry.get('dry_run') and not self.dry_run:
+                    self.dropped += 1
+                    continue
+                # * journals of earlier versions also hold failed stages
+                if not self.completed_by(entry['stage'], ChannelResult.from_record(None, entry['result'])):
+                    continue
+                self.completed[(entry['stage'], entry['id'])] = entry['result']
+
+    def lookup(self, stage, channel_id, index):
+        """ Result of a channel already finished by the stage in a previous run, None otherwise. """
+        record = self.completed.get((stage, channel_id))
+        if record is None:
+            return None
+        return ChannelResult.from_record(index, record)
+
+    def completed_by(self, stage, result):
+        """ False for a failed stage (errors) and a skipped archive (archive_failed), a resumed run retries them. """
+        if stage in self.retried_later:
+            return True
+        return not (result.errors or result.archive_failed)
+
+    def record(self, stage, channel_id, result):
+        if not self.completed_by(stage, result):
+            return
+        with self.lock:
+            self.buffer.append(json.dumps({'stage': stage, 'id': channel_id, 'dry_run': self.dry_run, 'result': result.to_record()}))
+            if len(self.buffer) >= self.flush_every:
+                self._write()
+
+    def _write(self):
+        if self.buffer:
+            # * what the journal points to (e.g. saved members) must be on disk before the journal says done
+            if self.before_flush:
+                self.before_flush()
+            self.file.write('\n'.join(self.buffer) + '\n')
+            self.file.flush()
+            self.buffer = []
+
+    def flush(self):
+        with self.lock:
+            self._write()
+
+    def close(self):
+        self.flush()
+        self.file.close()
@@ -0,0 +1,176 @@
+"""
+Member sets of the channels.
+User IDs are interned so the same "U..." string is shared by every channel it belongs to.
+"""
+
+import os
+import sys
+import threading
+
+import numpy as np
+
+
+class ChannelMembers():
+    """
+    Members of one channel, filled page by page while they are fetched.
+    Membership tests are O(1), the comma joined string is only built on demand for reports.
+    """
+    __slots__ = ('members',)
+
+    def __init__(self, members=()) -> None:
+        self.members = set()
+        self.add_page(members)
+
+    def add_page(self, page):
+        self.members.update(sys.intern(user_id) for user_id in page)
+
+    def __contains__(self, user_id):
+        return user_id in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return iter(sorted(self.members))
+
+    def joined(self):
+        return ','.join(self)
+
+
+class MemberStore():
+    """
+    Append only rollback store of the members of every channel processed, kept across runs:
+    a channel archived again later gets a new entry, the reader keeps the latest one.
+    User IDs are interned to integer indexes, each channel is a contiguous run of uint32 in members.u32.
+    Path : auto-archive/data/excelarchive/<WORKSPACE_NAME>members_rollback/
+        users.txt       --> line i is the user ID of index i
+        channels.tsv    --> channel_id, name, offset, count (offset and count in members.u32)
+        members.u32     --> little endian uint32 user indexes
+    users.txt reaches the disk before the members and channels that point to its lines.
+    """
+    def __init__(self, path) -> None:
+        self.path = path
+        self.user_index = {}
+        self.offset = 0
+        self.users_pending = False
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.repair()
+        self.users_file = open(os.path.join(path, 'users.txt'), 'a')
+        self.channels_file = open(os.path.join(path, 'channels.tsv'), 'a')
+        self.members_file = open(os.path.join(path, 'members.u32'), 'ab')
+
+    def repair(self):
+        """ Load the store of the previous runs and cut what a killed run left half written. """
+        users, channels, members = (os.path.join(self.path, name) for name in ('users.txt', 'channels.tsv', 'members.u32'))
+        if os.path.isfile(users):
+            truncate_to_last_line(users)
+            with open(users) as filecontent:
+                for user_id in filecontent.read().splitlines():
+                    self.user_index[sys.intern(user_id)] = len(self.user_index)
+        size = os.path.getsize(members) // 4 if os.path.isfile(members) else 0
+        if os.path.isfile(channels):
+            truncate_to_last_line(channels)
+            # * rows are written in offset order, keep the rows whose members are all on disk
+            valid = 0
+            with open(channels, 'rb') as filecontent:
+                for line in filecontent:
+                    fields = line.rstrip(b'\n').split(b'\t')
+                    if len(fields) != 4 or int(fields[2]) != self.offset or self.offset + int(fields[3]) > size:
+                        break
+                    self.offset += int(fields[3])
+                    valid += len(line)
+            os.truncate(channels, valid)
+        if os.path.isfile(members):
+            # * members after the last channel row belong to no channel, the next channel starts there
+            os.truncate(members, self.offset * 4)
+
+    def intern(self, user_id):
+        index = self.user_index.get(user_id)
+        if index is None:
+            index = self.user_index[sys.intern(user_id)] = len(self.user_index)
+            self.users_file.write(user_id + '\n')
+            self.users_pending = True
+        return index
+
+    def add_channel(self, channel_id, name, members):
+        with self.lock:
+            indexes = np.fromiter((self.intern(user_id) for user_id in members), dtype='<u4')
+            if self.users_pending:
+                self.users_file.flush()
+                self.users_pending = False
+            indexes.tofile(self.members_file)
+            self.channels_file.write('%s\t%s\t%d\t%d\n' % (channel_id, name, self.offset, len(indexes)))
+            self.offset += len(indexes)
+
+    def flush(self):
+        """ Users and members are flushed before the channel index that points to them. """
+        with self.lock:
+            self.users_file.flush()
+            self.members_file.flush()
+            self.channels_file.flush()
+
+    def close(self):
+        self.flush()
+        for filecontent in (self.members_file, self.users_file, self.channels_file):
+            filecontent.close()
+
+
+def truncate_to_last_line(path, block_size=1 << 16):
+    """ Cut a text file after its last newline, dropping a partial last line. """
+    with open(path, 'rb+') as filecontent:
+        end = filecontent.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - block_size)
+            filecontent.seek(start)
+            block = filecontent.read(position - start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            filecontent.truncate(position)
+
+
+class MemberStoreReader():
+    """
+    Read side of MemberStore for unarchive / restore tooling.
+    members.u32 is memory-mapped, a channel list is only materialised when asked for.
+    """
+    def __init__(self, path) -> None:
+        with open(os.path.join(path, 'users.txt')) as filecontent:
+            lines = filecontent.read().split('\n')
+        # * the last piece is '' or a user ID cut by a killed run
+        self.users = np.array(lines[:-1], dtype=object)
+        size = os.path.getsize(os.path.join(path, 'members.u32')) // 4
+        self.members = np.memmap(os.path.join(path, 'members.u32'), dtype='<u4', mode='r', shape=(size,)) if size else np.zeros(0, dtype='<u4')
+        # * positions of user indexes that never reached users.txt
+        unknown = np.flatnonzero(self.members >= len(self.users))
+        self.channels = {}
+        with open(os.path.join(path, 'channels.tsv')) as filecontent:
+            for line in filecontent:
+                fields = line.rstrip('\n').split('\t')
+                # * a run killed while writing can leave a partial last line
+                if len(fields) != 4 or int(fields[2]) + int(fields[3]) > size:
+                    continue
+                offset, count = int(fields[2]), int(fields[3])
+                if unknown.size and np.searchsorted(unknown, offset) < np.searchsorted(unknown, offset + count):
+                    continue
+                # * a channel saved by several runs, the latest entry wins
+                self.channels[fields[0]] = (fields[1], offset, count)
+
+    def __contains__(self, channel_id):
+        return channel_id in self.channels
+
+    def name_of(self, channel_id):
+        return self.channels[channel_id][0]
+
+    def member_indexes(self, channel_id):
+        """ uint32 view on the memory-mapped file, no copy. """
+        _, offset, count = self.channels[channel_id]
+        return self.members[offset:offset + count]
+
+    def members_of(self, channel_id):
+        return ChannelMembers(self.users[self.member_indexes(channel_id)])
@@ -0,0 +1,146 @@
+"""
+Run instrumentation: time spent per stage and per Slack method.
+Per stage --> count, total seconds, latency histogram
+Per Slack method --> calls, errors, retries, latency histogram, seconds waiting for the rate limiter,
+                     bytes sent and received
+Written at the end of the run as a JSON summary and optionally as a Prometheus textfile.
+"""
+
+from contextlib import contextmanager
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+# * upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+class Histogram():
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        for position, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[position] += 1
+                break
+
+    def summary(self):
+        return {'count': self.count, 'seconds': round(self.total, 6),
+                'buckets': {('+Inf' if bound == float('inf') else str(bound)): count
+                            for bound, count in zip(BUCKETS, self.counts)}}
+
+
+class Metrics():
+    """ Thread safe registry shared by the archiver, its rate limiter and its WebClients. """
+    API_FIELDS = ('calls', 'errors', 'retries', 'ratelimited_seconds', 'bytes_sent', 'bytes_received')
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.api = {}
+        self.api_latency = {}
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stages.setdefault(stage, Histogram()).observe(elapsed)
+
+    def _api(self, method):
+        if method not in self.api:
+            self.api[method] = dict.fromkeys(self.API_FIELDS, 0)
+            self.api_latency[method] = Histogram()
+        return self.api[method]
+
+    def api_call(self, method, seconds, error=False):
+        with self.lock:
+            counters = self._api(method)
+            counters['calls'] += 1
+            counters['errors'] += int(error)
+            self.api_latency[method].observe(seconds)
+
+    def api_retry(self, method):
+        with self.lock:
+            self._api(method)['retries'] += 1
+
+    def api_wait(self, method, seconds):
+        with self.lock:
+            self._api(method)['ratelimited_seconds'] += seconds
+
+    def api_bytes(self, method, sent, received):
+        with self.lock:
+            counters = self._api(method)
+            counters['bytes_sent'] += sent
+            counters['bytes_received'] += received
+
+    def summary(self):
+        with self.lock:
+            return {
+                'started': self.started,
+                'wall_seconds': round(time.time() - self.started, 3),
+                'stages': {stage: histogram.summary() for stage, histogram in self.stages.items()},
+                'api': {method: dict(counters, latency=self.api_latency[method].summary())
+                        for method, counters in self.api.items()},
+            }
+
+    def write_json(self, path):
+        with open(path, 'w') as filecontent:
+            json.dump(self.summary(), filecontent, indent=2)
+
+    def write_prometheus(self, path, labels=''):
+        """ node_exporter textfile collector format, written to a temporary file then renamed. """
+        summary = self.summary()
+        lines = ['slack_archive_wall_seconds%s %s' % ('{%s}' % labels if labels else '', summary['wall_seconds'])]
+        for name, histograms, label in (('slack_archive_stage_seconds', summary['stages'], 'stage'),
+                                        ('slack_archive_api_latency_seconds',
+                                         {method: counters['latency'] for method, counters in summary['api'].items()}, 'method')):
+            lines.append('# TYPE %s histogram' % name)
+            for key, histogram in histograms.items():
+                prefix = ('%s="%s"' % (label, key)) + (',' + labels if labels else '')
+                cumulative = 0
+                for bound, count in histogram['buckets'].items():
+                    cumulative += count
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (name, prefix, bound, cumulative))
+                lines.append('%s_sum{%s} %s' % (name, prefix, histogram['seconds']))
+                lines.append('%s_count{%s} %d' % (name, prefix, histogram['count']))
+        for field in self.API_FIELDS:
+            lines.append('# TYPE slack_archive_api_%s counter' % field)
+            for method, counters in summary['api'].items():
+                prefix = ('method="%s"' % method) + (',' + labels if labels else '')
+                lines.append('slack_archive_api_%s{%s} %s' % (field, prefix, round(counters[field], 6)))
+        with open(path + '.tmp', 'w') as filecontent:
+            filecontent.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+
+def timed(stage):
+    """ Decorator timing a method (or a coroutine method) of an object having a metrics attribute. """
+    def decorator(method):
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                with self.metrics.timer(stage):
+                    return await method(self, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.timer(stage):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,213 @@
+"""
+Rate limit scheduler shared by every Slack API call made by the archivers.
+Slack groups its Web API methods in Tiers (https://api.slack.com/docs/rate-limits),
+each Tier has its own per minute budget. One token bucket is kept per Tier.
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+from slack_sdk.errors import SlackApiError
+
+
+# * Slack Web API method --> Tier
+METHOD_TIERS = {
+    'admin_conversations_invite': 2,
+    'admin_conversations_search': 2,
+    'admin_conversations_unarchive': 2,
+    'conversations_archive': 2,
+    'files_upload': 2,
+    'conversations_list': 2,
+    'conversations_history': 3,
+    'chat_postMessage': 4,
+    'conversations_members': 4,
+}
+
+# * Documented minimum calls per minute for every Tier ("Tier 2 20+ per minute")
+TIER_LIMITS = {1: 1, 2: 20, 3: 50, 4: 100}
+
+
+class TokenBucket():
+    """
+    Thread safe token bucket. Starts at the documented rate of the Tier and adapts:
+    every 429 halves the rate, every success slowly raises it again up to the ceiling.
+    """
+    def __init__(self, per_minute, burst=None, ceiling=None) -> None:
+        self.floor = per_minute / 60.0 / 4
+        self.nominal = per_minute / 60.0
+        self.ceiling = (ceiling or per_minute * 2) / 60.0
+        self.rate = self.nominal
+        self.capacity = float(burst or max(1, per_minute // 10))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """ Take a token if one is available and return 0, else return the seconds to wait before trying again. """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """ Block until a token is available. Returns the seconds spent waiting. """
+        waited = 0.0
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self):
+        """ acquire for asyncio callers, the event loop keeps running while waiting. """
+        waited = 0.0
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def penalize(self, delay):
+        """ Slack answered 429: stop every caller of this Tier for delay seconds and slow down. """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            self.tokens = 0.0
+            self.rate = max(self.floor, self.rate / 2)
+
+    def reward(self):
+        """ Successful call: additive increase of the rate towards the ceiling. """
+        with self.lock:
+            self.rate = min(self.ceiling, self.rate + self.nominal / 50)
+
+
+class RateLimiter():
+    """
+    Schedules Slack Web API calls by Tier.
+    Usage : limiter.call(client.conversations_archive, channel=channel_id)
+    """
+    def __init__(self, tier_limits=None, max_retries=5, backoff_base=1.0, backoff_cap=60.0, logger=None, metrics=None) -> None:
+        limits = dict(TIER_LIMITS)
+        limits.update(tier_limits or {})
+        self.buckets = {tier: TokenBucket(per_minute) for tier, per_minute in limits.items()}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.logger = logger
+        self.metrics = metrics
+
+    def bucket_for(self, method):
+        return self.buckets[METHOD_TIERS.get(method, 2)]
+
+    def backoff(self, attempt):
+        """ Exponential backoff with full jitter. """
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def retry_after(error):
+        """ Seconds Slack asked us to wait in the Retry-After header, None if absent. """
+        headers = getattr(error.response, 'headers', None) or {}
+        value = headers.get('Retry-After', headers.get('retry-after'))
+        if isinstance(value, list):
+            value = value[0] if value else None
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def call(self, func, **kwargs):
+        """ Call a WebClient method under the Tier budget, retrying 429 responses. """
+        method = func.__name__
+        bucket = self.bucket_for(method)
+        attempt = 0
+        while True:
+            waited = bucket.acquire()
+            start = time.perf_counter()
+            try:
+                result = func(**kwargs)
+                bucket.reward()
+                self.record(method, waited, start, False)
+                return result
+            except SlackApiError as e:
+                self.record(method, waited, start, True)
+                if getattr(e.response, 'status_code', None) != 429 or attempt >= self.max_retries:
+                    raise
+                retry_after = self.retry_after(e)
+                delay = self.backoff(attempt) + (retry_after if retry_after is not None else self.backoff_base)
+                bucket.penalize(delay)
+                if self.logger:
+                    self.logger.warning('%s rate limited, retrying in %.1fs (attempt %d)' % (method, delay, attempt + 1))
+                if self.metrics:
+                    self.metrics.api_retry(method)
+                attempt += 1
+
+    def record(self, method, waited, start, error):
+        if self.metrics:
+            self.metrics.api_wait(method, waited)
+            self.metrics.api_call(method, time.perf_counter() - start, error)
+
+
+class AsyncRateLimiter(RateLimiter):
+    """
+    RateLimiter for AsyncWebClient methods, same Tier buckets and 429 handling.
+    tier_inflight bounds the requests in flight per Tier with one asyncio.Semaphore each, created
+    for the running event loop (a discovery run starts one loop per batch).
+    Usage : await limiter.call(async_client.conversations_archive, channel=channel_id)
+    """
+    def __init__(self, tier_limits=None, max_retries=5, backoff_base=1.0, backoff_cap=60.0, logger=None, metrics=None,
+                 tier_inflight=None) -> None:
+        super().__init__(tier_limits=tier_limits, max_retries=max_retries, backoff_base=backoff_base,
+                         backoff_cap=backoff_cap, logger=logger, metrics=metrics)
+        self.tier_inflight = tier_inflight or {}
+        self.inflight = {}
+        self.loop = None
+
+    def semaphore(self, tier):
+        """ In-flight semaphore of the Tier, for the running event loop. """
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.inflight = {tier: asyncio.Semaphore(self.tier_inflight.get(tier, 4)) for tier in self.buckets}
+        return self.inflight[tier]
+
+    async def call(self, func, **kwargs):
+        """ Await a AsyncWebClient method under the Tier budget, retrying 429 responses. """
+        method = func.__name__
+        tier = METHOD_TIERS.get(method, 2)
+        bucket = self.buckets[tier]
+        attempt = 0
+        while True:
+            waited = await bucket.acquire_async()
+            start = time.perf_counter()
+            try:
+                async with self.semaphore(tier):
+                    start = time.perf_counter()
+                    result = await func(**kwargs)
+                bucket.reward()
+                self.record(method, waited, start, False)
+                return result
+            except SlackApiError as e:
+                self.record(method, waited, start, True)
+                if getattr(e.response, 'status_code', None) != 429 or attempt >= self.max_retries:
+                    raise
+                retry_after = self.retry_after(e)
+                delay = self.backoff(attempt) + (retry_after if retry_after is not None else self.backoff_base)
+                bucket.penalize(delay)
+                if self.logger:
+                    self.logger.warning('%s rate limited, retrying in %.1fs (attempt %d)' % (method, delay, attempt + 1))
+                if self.metrics:
+                    self.metrics.api_retry(method)
+                attempt += 1
@@ -0,0 +1,104 @@
+"""
+Streaming writer for archived_output, one row appended as soon as a channel is finished.
+The members of the channels are saved by members.MemberStore.
+"""
+
+import csv
+import math
+import os
+import sys
+import threading
+
+try:
+    import xlsxwriter
+except ImportError:  # * optional, without it the xlsx report is written by pandas at close
+    xlsxwriter = None
+
+
+# * file extensions of the report (settings: archive_filename, REPORT_FORMAT)
+REPORT_FORMATS = ('.xlsx', '.csv', '.parquet')
+
+
+def report_format(path):
+    """ Extension of a report file, raises for a format the report cannot be written in. """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in REPORT_FORMATS:
+        raise Exception("Unsupported report format : %s (use %s)" % (path, ', '.join(REPORT_FORMATS)))
+    return extension
+
+
+def write_frame(df, path):
+    """ Write a whole report dataframe in the format of its file extension. """
+    extension = report_format(path)
+    if extension == '.csv':
+        df.to_csv(path)
+    elif extension == '.parquet':
+        df.to_parquet(path)
+    else:
+        df.to_excel(path)
+
+
+class ReportWriter():
+    """
+    Writes archived_output row by row. The format is picked from the file extension:
+    .xlsx --> xlsxwriter in constant_memory mode, .csv --> csv module,
+    .parquet --> rows kept and written by pandas at close (a column file is written in one go).
+    """
+    def __init__(self, path, columns) -> None:
+        self.path = path
+        self.extension = report_format(path)
+        self.columns = list(columns)
+        self.rows = []
+        self.rownum = 0
+        self.lock = threading.Lock()
+        self.workbook = self.worksheet = self.file = self.writer = None
+        if self.extension == '.csv':
+            self.file = open(path, 'w', newline='')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow([''] + self.columns)
+        elif self.extension == '.xlsx' and xlsxwriter is not None:
+            self.workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True,
+                                                       'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+                                                       'remove_timezone': True})
+            self.worksheet = self.workbook.add_worksheet()
+            self.worksheet.write_row(0, 1, self.columns)
+        self.rownum = 1
+
+    @staticmethod
+    def cell(value):
+        """ Convert numpy / pandas scalars and missing values to plain python for the writers. """
+        # * pandas values only exist once pandas is loaded, a restore of a few channels never loads it
+        pd = sys.modules.get('pandas')
+        if pd is None:
+            if isinstance(value, float) and math.isnan(value):
+                return None
+        elif pd.api.types.is_scalar(value) and pd.isna(value):
+            return None
+        elif isinstance(value, pd.Timestamp):
+            return value.to_pydatetime()
+        if hasattr(value, 'item'):
+            return value.item()
+        return value
+
+    def write_row(self, index, row):
+        values = [self.cell(row.get(column)) for column in self.columns]
+        with self.lock:
+            if self.writer is not None:
+                self.writer.writerow([index] + ['' if value is None else value for value in values])
+            elif self.worksheet is not None:
+                self.worksheet.write(self.rownum, 0, index)
+                self.worksheet.write_row(self.rownum, 1, values)
+            else:
+                self.rows.append((index, values))
+            self.rownum += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+            elif self.workbook is not None:
+                self.workbook.close()
+            else:
+                import pandas as pd
+                write_frame(pd.DataFrame([values for _, values in self.rows], index=[index for index, _ in self.rows],
+                                         columns=self.columns), self.path)
@@ -0,0 +1,186 @@
+from datetime import datetime
+import argparse
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from slack_sdk.errors import SlackApiError
+
+# * not standard imports crearted in the project
+from activity_index import ActivityIndex
+from clients import get_web_client
+from config import get_channel_settings
+from members import MemberStoreReader
+from metrics import Metrics, timed
+from ratelimit import RateLimiter
+from report import ReportWriter
+from utils import get_logger
+
+# * columns of the status report written to unarchive_output
+RESTORE_COLUMNS = ["ID", "Name", "MembersCount", "Unarchived", "MembersInvited", "MembersFailed",
+                   "InviteBatches", "IsError", "ErrorMessage"]
+
+
+class ChannelRestorer():
+    """
+    Rolls back a mass archive: unarchives the channels listed in unarchive.xlsx and re-invites
+    the members saved by ExcelArchiver in the rollback store.
+    Path : auto-archive/data/excelarchive/
+    Filename : unarchive.xlsx (column ID, optional column Name) --> unarchive_output.xlsx
+    With channel_ids only those channels are restored and the sheet is not read.
+    """
+    def __init__(self, channel_ids=None) -> None:
+        self.channel_ids = channel_ids
+        try:
+            # * get settings
+            self.settings = get_channel_settings()
+            self.logger = get_logger('channel_restorer', datetime.now().strftime("%d_%m_%Y")+'restore.log',
+                                     queued=self.settings.get('log_queue'))
+            self.metrics = Metrics()
+
+            # * unarchive and invite are admin methods, both go through the admin (person) connection
+            self.client_admin = get_web_client(self.settings.get('slack_token_admin'), self.settings, metrics=self.metrics)
+            self.ratelimiter = RateLimiter(tier_limits=self.settings.get('rate_limit_tiers'),
+                                           max_retries=self.settings.get('max_retries'),
+                                           logger=self.logger, metrics=self.metrics)
+            self.inflight_admin = threading.BoundedSemaphore(self.settings.get('admin_max_inflight'))
+
+            # * members saved by ExcelArchiver, memory-mapped (see members.py)
+            self.rollback = MemberStoreReader(self.settings.get('rollback_dir'))
+
+            # * restored channels are open again, the activity index must stop skipping them as archived
+            index_file = self.settings.get('activity_index_file')
+            self.activity_index = ActivityIndex(index_file) if self.settings.get('use_activity_index') or os.path.isfile(index_file) else None
+        except Exception as e:
+            self.exit_on_critical_exception(e)
+
+    ## * log the error and then exit the program, nothing can be restored without the inputs.
+    def exit_on_critical_exception(self, e):
+        self.logger.critical((e))
+        sys.exit(1)
+
+    ## * Read the channels to restore
+    @timed('readdata')
+    def readdata(self):
+        try:
+            if self.channel_ids:
+                return [(str(channel_id), None) for channel_id in dict.fromkeys(self.channel_ids)]
+            # * pandas is only loaded to read the sheet
+            from sheets import read_channels
+            df = read_channels(self.settings.get('unarchive_filename'), self.logger)
+            df = df.dropna(subset=["ID"]).drop_duplicates(subset=["ID"])
+            names = df["Name"] if "Name" in df.columns else [None] * len(df)
+            return [(str(channel_id), name) for channel_id, name in zip(df["ID"], names)]
+        except Exception as e:
+            self.exit_on_critical_exception(e)
+
+    ## * Restore every channel on a bounded thread pool (settings: restore_concurrency), the report is written in row order
+    def processdata(self, channels):
+        report = ReportWriter(self.settings.get('unarchive_output'), RESTORE_COLUMNS)
+        # * every call goes through the admin client, more workers than admin_max_inflight would only wait
+        workers = min(self.settings.get('restore_concurrency'), self.settings.get('admin_max_inflight'))
+        executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            for index, status in enumerate(executor.map(self.restore_channel, channels) if executor else map(self.restore_channel, channels)):
+                report.write_row(index, status)
+        finally:
+            if executor:
+                executor.shutdown()
+            report.close()
+
+    ## * Call a Slack method within the in-flight limit of the admin client and the Tier budget
+    def call_api(self, func, **kwargs):
+        with self.inflight_admin:
+            return self.ratelimiter.call(func, **kwargs)
+
+    ## * Unarchive one channel and invite its saved members back, returns the status row of the report
+    @timed('restore_channel')
+    def restore_channel(self, channel):
+        channel_id, name = channel
+        status = dict.fromkeys(RESTORE_COLUMNS, 0)
+        status.update({"ID": channel_id, "Name": name, "Unarchived": False, "IsError": False, "ErrorMessage": ""})
+        try:
+            if channel_id not in self.rollback:
+                raise Exception("No saved members for channel " + channel_id)
+            status["Name"] = name or self.rollback.name_of(channel_id)
+            members = list(self.rollback.members_of(channel_id))
+            status["MembersCount"] = len(members)
+
+            if self.settings.get('dry_run'):
+                return status
+            self.unarchive_channel(channel_id)
+            status["Unarchived"] = True
+            if self.activity_index is not None:
+                self.activity_index.update(channel_id, archived=0)
+            self.invite_members(channel_id, members, status)
+            self.logger.info('%s,%s,%d/%d' % (status["Name"], channel_id, status["MembersInvited"], len(members)))
+        except Exception as e:
+            status["IsError"] = True
+            status["ErrorMessage"] = str(e)
+            self.logger.error(e)
+        return status
+
+    def unarchive_channel(self, channel_id):
+        try:
+            self.call_api(self.client_admin.admin_conversations_unarchive, channel_id=channel_id) # ** Tier 2 20+ per minute
+        except SlackApiError as e:
+            # * restoring twice is harmless, the channel is already open
+            if e.response.get("error") != "not_archived":
+                raise
+
+    ## * Invite the members in batches of invite_batch_size user ids, the most admin.conversations.invite accepts
+    def invite_members(self, channel_id, members, status):
+        batch_size = self.settings.get('invite_batch_size')
+        for start in range(0, len(members), batch_size):
+            batch = members[start:start + batch_size]
+            status["InviteBatches"] += 1
+            try:
+                self.call_api(self.client_admin.admin_conversations_invite, channel_id=channel_id, user_ids=batch) # ** Tier 2 20+ per minute
+                status["MembersInvited"] += len(batch)
+            except SlackApiError as e:
+                error = e.response.get("error")
+                if error == "already_in_channel":
+                    status["MembersInvited"] += len(batch)
+                elif error == "failed_for_some_users":
+                    # * deactivated users and the like, members already in the channel count as invited
+                    failed = e.response.get("failed_user_ids") or {}
+                    if not isinstance(failed, dict):
+                        failed = dict.fromkeys(failed, "")
+                    failed = [user for user, reason in failed.items() if reason != "already_in_channel"]
+                    status["MembersInvited"] += len(batch) - len(failed)
+                    status["MembersFailed"] += len(failed)
+                else:
+                    status["MembersFailed"] += len(batch)
+                    status["IsError"] = True
+                    status["ErrorMessage"] = (str(error) + " " + status["ErrorMessage"]).strip()
+                    self.logger.error(e)
+
+    def main(self):
+        """
+        This is the main method that restores the channels listed in unarchive.xlsx (or given with --channel).
+        """
+        try:
+            if self.settings.get('dry_run'):
+                self.logger.info('THIS IS A DRY RUN. NO CHANNELS ARE ACTUALLY RESTORED.')
+            channels = self.readdata()
+            self.logger.info('%d channels to restore' % len(channels))
+            self.processdata(channels)
+        except Exception as e:
+            self.logger.error(e)
+        finally:
+            try:
+                if self.activity_index is not None:
+                    self.activity_index.close()
+                self.metrics.write_json(self.settings.get('restore_metrics_file'))
+            except Exception as e:
+                self.logger.error(e)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Unarchive the channels listed in unarchive.xlsx and invite their members back')
+    parser.add_argument('--channel', dest='channels', action='append', default=None,
+                        help='channel ID to restore instead of the sheet, can be repeated')
+    args = parser.parse_args()
+    CHANNEL_RESTORER = ChannelRestorer(channel_ids=args.channels)
+    CHANNEL_RESTORER.main()
@@ -0,0 +1,76 @@
+"""
+Per channel outcome records of the archival stages and the vectorized join
+that applies them to the output dataframe at the end of each stage.
+"""
+
+# * ChannelResult attribute --> output dataframe column
+COLUMNS = {
+    'members_count': 'MembersCount',
+    'allowlisted': 'Allowlisted',
+    'is_bot_member': 'IsBotMember',
+    'is_error': 'IsError',
+    'invite_failed': 'InviteFailed',
+    'get_members_failed': 'GetMembersFailed',
+    'archive_failed': 'ArchiveFailed',
+    'error_message': 'ErrorMessage',   # * only set to replace the messages of earlier stages (e.g. '')
+}
+
+
+class ChannelResult():
+    """
+    Outcome of one stage for one channel.
+    Attributes left to None are not touched when the record is applied to the dataframe.
+    """
+    __slots__ = ('index', 'errors') + tuple(COLUMNS)
+
+    def __init__(self, index) -> None:
+        self.index = index
+        self.errors = []
+        for attr in COLUMNS:
+            setattr(self, attr, None)
+
+    def add_error(self, e, failed_attr):
+        """ Record an error for the channel and mark the stage that failed. """
+        self.errors.append(format(e))
+        self.is_error = True
+        setattr(self, failed_attr, True)
+
+    def apply_to(self, row):
+        """ Copy of a row dict (column --> value) with this result applied, same rules as apply_results. """
+        row = dict(row)
+        for attr, column in COLUMNS.items():
+            if getattr(self, attr) is not None:
+                row[column] = getattr(self, attr)
+        if self.errors:
+            row['ErrorMessage'] = ''.join(reversed(self.errors)) + row['ErrorMessage']
+        return row
+
+    def to_record(self):
+        """ JSON serialisable form of the attributes set by the stage. """
+        record = {attr: getattr(self, attr) for attr in COLUMNS if getattr(self, attr) is not None}
+        if self.errors:
+            record['errors'] = self.errors
+        return record
+
+    @classmethod
+    def from_record(cls, index, record):
+        """ Rebuild a result saved with to_record for the row at index. """
+        result = cls(index)
+        for attr, value in record.items():
+            setattr(result, attr, value)
+        return result
+
+
+def apply_results(frame, results):
+    """ Join the records of one stage into frame with one assignment per column. """
+    records = [result for result in results if result is not None]
+    for attr, column in COLUMNS.items():
+        changed = [result for result in records if getattr(result, attr) is not None]
+        if changed:
+            frame.loc[[result.index for result in changed], column] = [getattr(result, attr) for result in changed]
+
+    # * latest error first, same order as the messages were concatenated before
+    failed = [result for result in records if result.errors]
+    if failed:
+        index = [result.index for result in failed]
+        frame.loc[index, 'ErrorMessage'] = [''.join(reversed(result.errors)) for result in failed] + frame.loc[index, 'ErrorMessage']
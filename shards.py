@@ -0,0 +1,123 @@
+"""
+Deterministic sharding of one channels sheet over several ExcelArchiver processes.
+    python excelarchive.py --shard 1/4  (or SHARD=1/4) --> channels whose crc32(ID) % 4 == 0
+Every shard writes its own report, journal, rollback store, payloads, metrics and activity index, prefixed
+with shard<i>of<N>_, and can use its own tokens (SLACK_TOKEN_SHARD_<i>, SLACK_ADMIN_TOKEN_SHARD_<i>).
+Once every shard is done the outputs are merged back:
+    python shards.py merge 4
+"""
+
+import argparse
+import os
+import zlib
+
+# * not standard imports crearted in the project
+from activity_index import ActivityIndex
+from config import get_channel_settings
+from members import MemberStore, MemberStoreReader
+from report import ReportWriter
+
+# * settings holding a file written by the run, one per shard
+SHARDED_SETTINGS = ('archive_filename', 'rollback_dir', 'journal_file', 'payload_log_file',
+                    'metrics_file', 'audit_log_file', 'activity_index_file', 'bot_user_cache_file')
+
+
+def parse_shard(text):
+    """ "i/N" --> (i, N), 1 <= i <= N. """
+    try:
+        index, count = (int(part) for part in str(text).split('/'))
+    except ValueError:
+        raise Exception("Shard must be i/N, e.g. 1/4 : " + str(text))
+    if not 1 <= index <= count:
+        raise Exception("Shard index must be between 1 and N : " + str(text))
+    return index, count
+
+
+def shard_of(ids, count):
+    """ Shard (1 to count) of every channel ID, stable across runs, processes and machines. """
+    import numpy as np
+    return np.fromiter((zlib.crc32(str(channel_id).encode('utf-8')) % count + 1 for channel_id in ids),
+                       dtype=np.int64, count=len(ids))
+
+
+def shard_path(path, index, count):
+    """ Path of a run output for one shard: <dir>/shard<i>of<N>_<name>. """
+    directory, name = os.path.split(path)
+    return os.path.join(directory, 'shard%dof%d_%s' % (index, count, name))
+
+
+def shard_settings(settings, index, count):
+    """ Point the outputs of the run at the shard files and pick the shard tokens if there are any. """
+    for key in SHARDED_SETTINGS:
+        if settings.get(key):
+            settings[key] = shard_path(settings[key], index, count)
+    for key, variable in (('slack_token', 'SLACK_TOKEN_SHARD_%d'), ('slack_token_admin', 'SLACK_ADMIN_TOKEN_SHARD_%d')):
+        if os.environ.get(variable % index):
+            settings[key] = os.environ[variable % index]
+    return settings
+
+
+def read_report(path):
+    import pandas as pd
+    if path.lower().endswith('.csv'):
+        return pd.read_csv(path, index_col=0, keep_default_na=False)
+    if path.lower().endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_excel(path, index_col=0)
+
+
+def merge_reports(settings, count):
+    """ One archived_output with the rows of every shard, in the order of the channels sheet. """
+    import pandas as pd
+    frames = []
+    for index in range(1, count + 1):
+        path = shard_path(settings.get('archive_filename'), index, count)
+        if not os.path.isfile(path):
+            raise Exception("Missing report of shard %d/%d : %s" % (index, count, path))
+        frames.append(read_report(path))
+    merged = pd.concat(frames).sort_index(kind='stable')
+    report = ReportWriter(settings.get('archive_filename'), merged.columns)
+    for index, row in zip(merged.index, merged.to_dict('records')):
+        report.write_row(index, row)
+    report.close()
+    return merged
+
+
+def merge_rollback(settings, count):
+    """ One rollback store with the members of every shard, for restore.py. """
+    merged = MemberStore(settings.get('rollback_dir'))
+    for index in range(1, count + 1):
+        path = shard_path(settings.get('rollback_dir'), index, count)
+        if not os.path.isdir(path):
+            continue
+        reader = MemberStoreReader(path)
+        for channel_id in reader.channels:
+            merged.add_channel(channel_id, reader.name_of(channel_id), reader.members_of(channel_id))
+    merged.close()
+
+
+def merge_activity_index(settings, count):
+    """ Channel states learnt by every shard into the activity index of unsharded runs. """
+    paths = [shard_path(settings.get('activity_index_file'), index, count) for index in range(1, count + 1)]
+    paths = [path for path in paths if os.path.isfile(path)]
+    if not paths:
+        return
+    merged = ActivityIndex(settings.get('activity_index_file'))
+    for path in paths:
+        shard = ActivityIndex(path)
+        for channel_id, state in shard.load().items():
+            merged.update(channel_id, **{field: value for field, value in state.items() if value is not None})
+        shard.close()
+    merged.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge the outputs of a sharded run')
+    parser.add_argument('command', choices=('merge',))
+    parser.add_argument('count', type=int, help='number of shards N')
+    args = parser.parse_args()
+    SETTINGS = get_channel_settings()
+    MERGED = merge_reports(SETTINGS, args.count)
+    merge_rollback(SETTINGS, args.count)
+    merge_activity_index(SETTINGS, args.count)
+    print('%d channels merged from %d shards into %s' % (len(MERGED), args.count, SETTINGS.get('archive_filename')))
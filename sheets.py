@@ -0,0 +1,138 @@
+"""
+Readers for the channels sheet (settings: channelscsvfile).
+The format is picked from the file extension: xlsx/xls, csv, parquet and arrow/feather.
+Excel files are converted once to a Parquet sidecar (<file>.parquet) which is loaded
+instead of the workbook as long as the workbook mtime and hash are unchanged.
+The Last activity column is parsed once to seconds since the epoch (LastActivityTs),
+cached in the sidecar with the rest of the sheet.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+READERS = {
+    '.csv': pd.read_csv,
+    '.parquet': pd.read_parquet,
+    '.pq': pd.read_parquet,
+    '.feather': pd.read_feather,
+    '.arrow': pd.read_feather,
+}
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+
+# * format of Last activity in the Slack workspace export, e.g. "Mon, 01 Jan 2018 00:00:00 +0000"
+LAST_ACTIVITY_FORMAT = '%a, %d %b %Y %H:%M:%S %z'
+# * tried in order only on the rows the export format could not parse, 'mixed' guesses row by row
+FALLBACK_FORMATS = ('%d/%m/%y', 'mixed')
+ACTIVITY_COLUMN = 'LastActivityTs'
+# * stamped in the sidecar, a LastActivityTs cached by another version of parse_last_activity is parsed again
+ACTIVITY_PARSER = 2
+
+
+def file_hash(path):
+    """ sha256 of the file content. """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as filecontent:
+        for block in iter(lambda: filecontent.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sidecar_paths(path):
+    return path + '.parquet', path + '.parquet.json'
+
+
+def read_sidecar(path):
+    """ Return the cached dataframe of an excel file or None if missing or stale. """
+    sidecar, meta = sidecar_paths(path)
+    if not (os.path.isfile(sidecar) and os.path.isfile(meta)):
+        return None
+    with open(meta) as filecontent:
+        stamp = json.load(filecontent)
+    if stamp.get('mtime') != os.path.getmtime(path) or stamp.get('sha256') != file_hash(path):
+        return None
+    df = pd.read_parquet(sidecar)
+    if stamp.get('activity_parser') != ACTIVITY_PARSER and ACTIVITY_COLUMN in df.columns:
+        df = df.drop(columns=[ACTIVITY_COLUMN])
+    return df
+
+
+def write_sidecar(path, df):
+    sidecar, meta = sidecar_paths(path)
+    df.to_parquet(sidecar)
+    with open(meta, 'w') as filecontent:
+        json.dump({'mtime': os.path.getmtime(path), 'sha256': file_hash(path), 'activity_parser': ACTIVITY_PARSER}, filecontent)
+
+
+def parse_last_activity(values):
+    """ Seconds since the epoch (float, NaN when not a date) of a Last activity column. """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        parsed = pd.to_datetime(values, utc=True)
+    else:
+        parsed = pd.to_datetime(values, format=LAST_ACTIVITY_FORMAT, errors='coerce', utc=True)
+        for fallback in FALLBACK_FORMATS:
+            failed = parsed.isna() & values.notna()
+            if not failed.any():
+                break
+            # * dayfirst only for the day/month/year format, 'mixed' keeps ISO dates (2020-01-02) as they are
+            parsed[failed] = pd.to_datetime(values[failed].astype(str), format=fallback, errors='coerce',
+                                            utc=True, dayfirst=(fallback != 'mixed'))
+    return (parsed - pd.Timestamp(0, tz='UTC')).dt.total_seconds()
+
+
+def add_activity_column(df):
+    """ Add LastActivityTs to a sheet having a Last activity column, True if it was added. """
+    if 'Last activity' not in df.columns or ACTIVITY_COLUMN in df.columns:
+        return False
+    df[ACTIVITY_COLUMN] = parse_last_activity(df['Last activity'])
+    return True
+
+
+def inactive_mask(df, too_old_datetime):
+    """
+    Boolean array of the channels worth archiving, same predicates as the original sheet filter:
+    (no members or no activity since too_old_datetime) and not archived.
+    Rows whose Last activity could not be parsed are only kept when they have no members.
+    """
+    missing = np.full(len(df), np.nan)
+    activity = df[ACTIVITY_COLUMN].to_numpy(dtype=float) if ACTIVITY_COLUMN in df.columns else missing
+    members = pd.to_numeric(df['Members'], errors='coerce').to_numpy(dtype=float) if 'Members' in df.columns else missing
+    archived = pd.to_numeric(df['Archived'], errors='coerce').to_numpy(dtype=float) if 'Archived' in df.columns else missing
+    return ((members < 1) | (activity < too_old_datetime.timestamp())) & (archived != 1)
+
+
+def read_channels(path, logger=None):
+    """ Read the channels sheet in a dataframe whatever its format. """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in READERS:
+        df = READERS[extension](path)
+        add_activity_column(df)
+        return df
+    if extension not in EXCEL_EXTENSIONS:
+        raise Exception("Unsupported channels file format : " + path)
+
+    # * the sidecar is only a cache, any failure falls back to reading the excel file
+    try:
+        df = read_sidecar(path)
+        if df is not None:
+            # * sidecar written before LastActivityTs was cached, or by another ACTIVITY_PARSER
+            if add_activity_column(df):
+                write_sidecar(path, df)
+            return df
+    except Exception as e:
+        if logger:
+            logger.warning('Ignoring parquet cache of %s : %s' % (path, e))
+
+    df = pd.read_excel(path)
+    add_activity_column(df)
+    try:
+        write_sidecar(path, df)
+    except Exception as e:
+        if logger:
+            logger.warning('Could not write parquet cache of %s : %s' % (path, e))
+    return df
@@ -1,6 +1,15 @@
 #!/usr/bin/env python
 
+import atexit
+import gzip
+import json
 import logging
+import logging.handlers
+import mmap
+import os
+import queue
+import threading
+import zlib
 
 class CustomFormatter(logging.Formatter):
 
@@ -21,28 +30,146 @@ class CustomFormatter(logging.Formatter):
         logging.CRITICAL: criticalcolor + format + reset
     }
 
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # * one Formatter per level, compiled once instead of on every record
+        self.formatters = {level: logging.Formatter(log_fmt) for level, log_fmt in self.FORMATS.items()}
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self.formatters.get(record.levelno)
+        if formatter is None:
+            return super().format(record)
         return formatter.format(record)
-    
 
-def get_logger(logger_name, logger_file, log_level=logging.INFO):
-    """ Setup the logger and return it. """
+
+# * QueueListener of every queued logger, stopped (and so drained) at exit
+_listeners = {}
+
+
+def get_logger(logger_name, logger_file, log_level=logging.INFO, queued=False):
+    """
+    Setup the logger and return it.
+    With queued=True the records are only put on a queue by the calling thread,
+    a QueueListener thread formats them and writes the log file and the console.
+    """
     log_format = "%(name)s | %(levelname)s | %(funcName)s() | %(message)s | (%(filename)s:%(lineno)d)"
+    # define a Handler which writes INFO messages or higher to the sys.stderr
+    console = logging.StreamHandler()
+    console.setLevel(log_level)
+    # tell the handler to use the colored format
+    console.setFormatter(CustomFormatter())
+    logger = logging.getLogger(logger_name)
+
+    if queued:
+        if logger_name not in _listeners:
+            logfile = logging.FileHandler(logger_file, mode='w')
+            logfile.setFormatter(logging.Formatter(log_format))
+            records = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(records, logfile, console)
+            listener.start()
+            atexit.register(listener.stop)
+            _listeners[logger_name] = listener
+            logger.addHandler(logging.handlers.QueueHandler(records))
+            logger.setLevel(log_level)
+            # * the listener writes the log file, the root handlers would write every record a second time
+            logger.propagate = False
+        return logger
+
     logging.basicConfig(level=log_level,
                         format=log_format,
                         datefmt='%y-%m-%d_%H:%M',
                         filename=logger_file,
                         filemode='w')
-    # define a Handler which writes INFO messages or higher to the sys.stderr
-    console = logging.StreamHandler()
-    console.setLevel(log_level)
-    # set a format which is simpler for console use
-    formatter = logging.Formatter(log_format)
-    # tell the handler to use this format
-    console.setFormatter(CustomFormatter())
-    # add the handler to the root logger
-    logging.getLogger(logger_name).addHandler(console)
+    # add the handler to the logger
+    logger.addHandler(console)
+
+    return logger
+
+
+# * magic and deflate method of every gzip member
+GZIP_HEADER = b'\x1f\x8b\x08'
+
+
+class PayloadLog():
+    """
+    Compressed stream of structured records too bulky for the text log (member lists, API payloads).
+    One JSON object per line in a gzip file: {"kind": ..., fields...}, read back with read_payloads.
+    Every flush ends a gzip member, with resume=True a run appends its members to the file.
+    """
+    def __init__(self, path, resume=False, compresslevel=6) -> None:
+        self.path = path
+        self.compresslevel = compresslevel
+        self.raw = self.file = None
+        self.lock = threading.Lock()
+        if not path:
+            return
+        self.raw = open(path, 'ab' if resume else 'wb')
+
+    def write(self, kind, **fields):
+        if self.raw is None:
+            return
+        line = json.dumps(dict(fields, kind=kind), separators=(',', ':'))
+        with self.lock:
+            if self.file is None:
+                self.file = gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=self.compresslevel)
+            self.file.write(line.encode('utf-8') + b'\n')
+
+    def _end_member(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.raw.flush()
+
+    def flush(self):
+        """ Push what was written so far to disk, a crashed run loses at most the records since the last flush. """
+        if self.raw is not None:
+            with self.lock:
+                self._end_member()
+
+    def close(self):
+        if self.raw is not None:
+            with self.lock:
+                self._end_member()
+                self.raw.close()
+                self.raw = None
+
 
-    return logging.getLogger(logger_name)
+def read_payloads(path, chunk_size=1 << 20):
+    """
+    Yield the records of a PayloadLog file member by member. The member cut by an interrupted
+    run is skipped up to the next gzip header, where the records of the resumed run start.
+    """
+    try:
+        filecontent = open(path, 'rb')
+    except OSError:
+        return
+    with filecontent:
+        size = os.fstat(filecontent.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(filecontent.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = 0
+            while position < size:
+                start = position
+                decompressor = zlib.decompressobj(31)
+                text = []
+                try:
+                    while not decompressor.eof and position < size:
+                        chunk = data[position:position + chunk_size]
+                        text.append(decompressor.decompress(chunk))
+                        position += len(chunk)
+                except zlib.error:
+                    position = data.find(GZIP_HEADER, start + 1)
+                    if position < 0:
+                        return
+                    continue
+                lines = b''.join(text).split(b'\n')
+                if decompressor.eof:
+                    position -= len(decompressor.unused_data)
+                for line in lines[:-1]:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # * last member of an interrupted run
+                        return
+                    yield record
@@ -0,0 +1,150 @@
+"""
+Runs ExcelArchiver for several Slack workspaces in parallel, one worker process per workspace,
+each with its own tokens, input sheet, allowlist and so its own rate limit budget.
+Manifest (JSON) :
+{
+    "workspaces": [
+        {"name": "acme", "slack_token": "$ACME_SLACK_TOKEN", "slack_token_admin": "$ACME_ADMIN_TOKEN",
+         "channels_file": "acme_channels.xlsx", "allowlist_file": "acme_allowlist.txt",
+         "admin_channel": "C0123456", "env": {"DRY_RUN": "true"}, "settings": {"concurrency": 4}}
+    ],
+    "summary": {"slack_token": "$SLACK_TOKEN", "channel": "C0123456"}
+}
+Values starting with $ are read from the environment so the manifest holds no secret.
+Every workspace writes its reports, journal and rollback store under its name (WORKSPACE_NAME).
+Usage : python workspaces.py workspaces.json --workers 4
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import argparse
+import json
+import os
+import time
+
+# * not standard imports crearted in the project
+from clients import get_web_client
+from config import get_channel_settings
+from utils import get_logger
+
+# * manifest key --> environment variable read by config.get_channel_settings
+ENVIRONMENT = {
+    'slack_token': 'SLACK_TOKEN',
+    'slack_token_admin': 'SLACK_ADMIN_TOKEN',
+    'admin_channel': 'ADMIN_CHANNEL',
+    'channels_file': 'CHANNELS_FILE',
+}
+
+
+def resolve(value):
+    """ $NAME --> value of the environment variable NAME. """
+    if isinstance(value, str) and value.startswith('$'):
+        return os.environ.get(value[1:], '')
+    return value
+
+
+def run_workspace(workspace, resume=False, use_async=False):
+    """ Worker process: archive one workspace and return its summary. """
+    name = workspace['name']
+    os.environ['WORKSPACE_NAME'] = name + '_'
+    for key, variable in ENVIRONMENT.items():
+        if key in workspace:
+            os.environ[variable] = str(resolve(workspace[key]))
+    os.environ.update({variable: str(resolve(value)) for variable, value in (workspace.get('env') or {}).items()})
+    overrides = dict(workspace.get('settings') or {})
+    if 'allowlist_file' in workspace:
+        # * relative to the data path like the default allowlist.txt
+        data_path = os.path.dirname(get_channel_settings().get('allowlistfile'))
+        overrides['allowlistfile'] = os.path.join(data_path, resolve(workspace['allowlist_file']))
+
+    summary = {'workspace': name, 'ok': False, 'channels': 0, 'archived': 0, 'allowlisted': 0, 'errors': 0}
+    start = time.perf_counter()
+    try:
+        if use_async:
+            from asyncarchive import AsyncExcelArchiver as Archiver
+        else:
+            from excelarchive import ExcelArchiver as Archiver
+        archiver = Archiver(resume=resume, overrides=overrides)
+        archiver.main()
+        summary.update(archiver.totals)
+        summary.update({'ok': True, 'report': archiver.settings.get('archive_filename'),
+                        'dry_run': archiver.settings.get('dry_run')})
+    except SystemExit:
+        # * critical error at startup, already logged in the audit log of the workspace
+        summary['error'] = 'critical error, see ' + get_channel_settings().get('audit_log_file')
+    except Exception as e:
+        summary['error'] = str(e)
+    summary['wall_s'] = round(time.perf_counter() - start, 1)
+    return summary
+
+
+class WorkspacesRunner():
+    """ Parallel runs of the archiver over the workspaces of a manifest and combined summary. """
+    def __init__(self, manifest, workers=None, resume=False, use_async=False) -> None:
+        self.settings = get_channel_settings()
+        self.logger = get_logger('workspaces_runner', datetime.now().strftime("%d_%m_%Y")+'workspaces.log')
+        with open(manifest) as filecontent:
+            self.manifest = json.load(filecontent)
+        self.workspaces = self.manifest.get('workspaces') or []
+        self.workers = workers or len(self.workspaces) or 1
+        self.resume = resume
+        self.use_async = use_async
+
+    def process(self):
+        """ One fresh process per workspace (max_tasks_per_child=1) so no environment leaks between workspaces. """
+        names = [workspace['name'] for workspace in self.workspaces]
+        if len(set(names)) != len(names):
+            raise Exception("Workspace names must be unique : " + ', '.join(names))
+        summaries = []
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(self.workspaces) or 1), max_tasks_per_child=1) as executor:
+            futures = [executor.submit(run_workspace, workspace, self.resume, self.use_async) for workspace in self.workspaces]
+            for workspace, future in zip(self.workspaces, futures):
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    summary = {'workspace': workspace['name'], 'ok': False, 'error': str(e)}
+                self.logger.info(summary)
+                summaries.append(summary)
+        return summaries
+
+    def format_summary(self, summaries):
+        lines = ['Archival summary, %d workspaces' % len(summaries)]
+        for summary in summaries:
+            if summary.get('ok'):
+                lines.append('%s%s : %d channels, %d archived, %d allowlisted, %d errors (%.0fs)' % (
+                    '[DRY RUN] ' if summary.get('dry_run') else '', summary['workspace'], summary['channels'],
+                    summary['archived'], summary['allowlisted'], summary['errors'], summary['wall_s']))
+            else:
+                lines.append('%s : FAILED %s' % (summary['workspace'], summary.get('error', '')))
+        return '\n'.join(lines)
+
+    ## * Write the combined summary next to the reports and post it (manifest: summary)
+    def send_summary(self, summaries):
+        path = os.path.join(os.path.dirname(self.settings.get('archive_filename')), 'workspaces_summary.json')
+        with open(path, 'w') as filecontent:
+            json.dump(summaries, filecontent, indent=2)
+        message = self.format_summary(summaries)
+        self.logger.info(message)
+        target = self.manifest.get('summary') or {}
+        if target.get('channel'):
+            try:
+                client = get_web_client(resolve(target.get('slack_token', '$SLACK_TOKEN')), self.settings)
+                client.chat_postMessage(channel=target['channel'], text=message)
+            except Exception as e:
+                self.logger.error(e)
+
+    def main(self):
+        summaries = self.process()
+        self.send_summary(summaries)
+        return summaries
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive several Slack workspaces in parallel from a manifest')
+    parser.add_argument('manifest', help='JSON manifest of the workspaces')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, default one per workspace')
+    parser.add_argument('--resume', action='store_true', help='resume every workspace from its journal')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='use AsyncExcelArchiver (needs aiohttp)')
+    args = parser.parse_args()
+    WORKSPACES_RUNNER = WorkspacesRunner(args.manifest, workers=args.workers, resume=args.resume, use_async=args.use_async)
+    WORKSPACES_RUNNER.main()